@@ -77,3 +77,39 @@ export const startCall = async(customerId) => {
         throw error;
     }
 }
+
+// Dashboard counts and outstanding amounts, aggregated on the server
+export const fetchSummary = async() => {
+    try {
+        const response = await fetch(`${url}/summary`);
+        return response.json();
+    } catch (error) {
+        console.error("Error fetching summary:", error);
+        throw error;
+    }
+}
+
+// Full-text search over customer names, phone numbers and call notes.
+// Returns { customers, offset, next_offset }; next_offset is null on the last page.
+export const searchCustomers = async(query, offset = 0, limit = 20) => {
+    try {
+        const params = new URLSearchParams({ q: query, offset, limit });
+        const response = await fetch(`${url}/search?${params}`);
+        return response.json();
+    } catch (error) {
+        console.error("Error searching customers:", error);
+        throw error;
+    }
+}
+
+// Live customer/call events pushed by the server (Server-Sent Events).
+// EventSource reconnects on its own and resumes from the last received event id.
+// Returns the EventSource; call .close() on it to stop listening.
+export const subscribeToEvents = (onEvent) => {
+    const source = new EventSource(`${url}/events`);
+    ["customer_added", "status_changed", "sms_sent", "call_ended", "outcomes_updated", "reset"].forEach((type) => {
+        source.addEventListener(type, (message) => onEvent(JSON.parse(message.data)));
+    });
+    source.onerror = (error) => console.error("Event stream error:", error);
+    return source;
+}
@@ -20,7 +20,7 @@ function UpdatedCustomers() {
     useEffect(() => {
         const fetchCustomers = async () => {
             try {
-                const data = await fetchUpdatedCustomers('all-customers');
+                const data = await fetchUpdatedCustomers('all-customers?include_notes=true');
                 setCustomers(data.customers || []);
             } catch (e) {
                 setError(e.message);
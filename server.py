@@ -1,25 +1,53 @@
+import time # Added for middleware timing
+_import_started = time.perf_counter()
+
 import tempfile
 import os
-import requests
+import asyncio
+import threading
 import aiofiles
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, File, HTTPException, UploadFile, Request # Added Request for middleware
 from fastapi.middleware.cors import CORSMiddleware
-from collections import defaultdict
-import time # Added for middleware timing
-import json # Added for pretty printing dicts
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from collections import OrderedDict
+import logging
 
 # Import custom modules
 from src.database import Database
 from src.services import vapi_service
 from src.services import transcription_service
-from src.dialogue_agent import Dialogue_agent
+from src.dialogue_agent import Dialogue_agent, call_status_for_intent
 from src.action_agent import Action_agent
 from src.sentiment_agent import Sentiment_agent
 from src.services.mcp_service import lookup_number
+from src.services import metrics_service
+from src.services.metrics_service import timer
+from src.services.logging_service import setup_logging, bind_call, bind_customer
+from src.services.turn_coordinator import Turn_coordinator
+from src.services.idempotency import Idempotency_cache, message_key
+from src.services.llm_guard import turn_budget
+from src.services.event_stream import Event_broker
+from src.services import profiling_service
+from src.services.conversation_archive import STALE_AFTER_SECONDS, Turn_record, decode_turns, history_lines
+from src.services.profiling_service import profiled
 
 from pydantic import BaseModel, Field
 from datetime import date
 
+try:
+    import orjson
+
+    def json_dumps(value) -> bytes:
+        return orjson.dumps(value)
+except ImportError:  ## orjson is optional; the stdlib encoder gives the same JSON, just slower
+    import dataclasses
+    import json
+
+    def json_dumps(value) -> bytes:
+        return json.dumps(value, separators = (",", ":"), default = dataclasses.asdict).encode()
+
 class CustomerCreate(BaseModel):
     name: str
     phone: str
@@ -27,225 +55,580 @@ class CustomerCreate(BaseModel):
     loan_amount: float = Field(..., gt=0) # Ensure loan amount is positive
 
 ##  Initialization 
-print("Initializing FastAPI App.")
-app = FastAPI(title="Loan Collection AI Agent API")
-
-print("Initializing Database...")
-db = Database()
-print("Initializing Dialogue Agent...")
-dialogue_agent = Dialogue_agent()
-print("Initializing Action Agent...")
-action_agent = Action_agent()
-print("Initializing Sentiment Agent...")
-sentiment_agent = Sentiment_agent()
-
-conversation_histories = defaultdict(list)
-print("Initialization Complete.")
+setup_logging()
+logger = logging.getLogger("server")
+
+##  Lazily initialized dependencies
+## Nothing here opens a connection or creates an SDK client at import time, so importing
+## the app is cheap and safe to do once in the gunicorn master (--preload) before forking.
+## Each worker builds its own instances on first use, or up front in the lifespan hook
+## when EAGER_INIT=1.
+_components = {}
+_components_lock = threading.Lock()
+startup_timings = {}
+
+def _component(name: str, factory):
+    instance = _components.get(name)
+    if instance is None:
+        with _components_lock:
+            instance = _components.get(name)
+            if instance is None:
+                start = time.perf_counter()
+                instance = factory()
+                startup_timings[name] = time.perf_counter() - start
+                metrics_service.set_gauge("component_init_seconds", startup_timings[name], {"component": name}, aggregate = "max")
+                logger.info("Initialized %s in %.3fs", name, startup_timings[name])
+                _components[name] = instance
+    return instance
+
+def get_db() -> Database:
+    return _component("database", lambda: Database(seed = os.getenv("SEED_DATABASE") == "1"))
+
+def get_dialogue_agent() -> Dialogue_agent:
+    return _component("dialogue_agent", Dialogue_agent)
+
+def get_action_agent() -> Action_agent:
+    return _component("action_agent", Action_agent)
+
+def get_sentiment_agent() -> Sentiment_agent:
+    return _component("sentiment_agent", Sentiment_agent)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Optionally warms dependencies before serving, and logs a startup timing report."""
+    if os.getenv("EAGER_INIT") == "1":
+        for getter in (get_db, get_dialogue_agent, get_action_agent, get_sentiment_agent):
+            await asyncio.to_thread(getter)
+    logger.info("Startup report", extra = {"import_seconds": round(import_seconds, 4), "components": startup_timings})
+    metrics_service.start_flusher()
+    yield
+    await event_broker.close()
+    metrics_service.write_snapshot()
+    if "dialogue_agent" in _components and _components["dialogue_agent"].intent_index is not None:
+        _components["dialogue_agent"].intent_index.save()
+    if "database" in _components:
+        _components["database"].close()
+
+## call_id -> customer snapshot (id, name, phone, due_date, loan_amount) bound at dial time.
+## An LRU in front of the call_bindings table: calls whose call-end never arrives fall out of it.
+call_contexts = OrderedDict()
+CALL_CONTEXT_CACHE_SIZE = int(os.getenv("CALL_CONTEXT_CACHE_SIZE", "1000"))
+CALL_CONTEXT_FIELDS = ("id", "name", "phone", "due_date", "loan_amount")
+## Fans the persisted change feed out to /events subscribers of this worker
+event_broker = Event_broker(get_db)
+
+## Claims taken from /start-call without a worker_id (the operator UI) are recorded under this dialer id
+OPERATOR_WORKER_ID = "operator"
+
+## Debounces rapid transcript fragments and cancels stale in-flight turns per call (state shared by all workers)
+turn_coordinator = Turn_coordinator(get_db)
+## Processed webhook deliveries and their replies, so Vapi's retries are answered without re-running them
+webhook_dedupe = Idempotency_cache(get_db)
+in_flight_requests = 0
+
+metrics_service.register_gauge("calls_in_flight", lambda: get_db().live_call_count(), "Live calls with an active conversation history (all workers).", aggregate = "max")
+metrics_service.describe("http_not_modified_total", "List requests answered with 304 Not Modified.")
+metrics_service.register_gauge("http_requests_in_flight", lambda: in_flight_requests, "HTTP requests currently being handled.")
+
+app = FastAPI(title="Loan Collection AI Agent API", lifespan = lifespan)
 
 ##  Middleware for Logging Requests
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    start_time = time.time()
-    print(f"--> Incoming Request: {request.method} {request.url.path}")
+    global in_flight_requests
+    start_time = time.perf_counter()
+    status_code = 500
+    in_flight_requests += 1
+    logger.debug("--> Incoming Request: %s %s", request.method, request.url.path)
     try:
         response = await call_next(request)
-        process_time = time.time() - start_time
-        print(f"<-- Response Status: {response.status_code} for {request.url.path} (took {process_time:.4f}s)")
+        status_code = response.status_code
+        process_time = time.perf_counter() - start_time
+        logger.debug("<-- Response Status: %s for %s (took %.4fs)", response.status_code, request.url.path, process_time)
     except Exception as e:
-        process_time = time.time() - start_time
-        print(f"<-- EXCEPTION during request {request.url.path} (took {process_time:.4f}s): {e}")
+        process_time = time.perf_counter() - start_time
+        logger.exception("<-- EXCEPTION during request %s (took %.4fs): %s", request.url.path, process_time, e)
         ## Re-raise the exception so FastAPI handles it
         raise e
+    finally:
+        in_flight_requests -= 1
+        ## Label by route template (e.g. /start-call/{customer_id}) to keep label cardinality bounded
+        route = request.scope.get("route")
+        path = route.path if route else "unmatched"
+        metrics_service.observe(
+            "http_request_seconds",
+            time.perf_counter() - start_time,
+            {"method": request.method, "path": path, "status": status_code},
+        )
     return response
 
+## Opt-in profiling: requests with "X-Profile: <ADMIN_TOKEN>" or a PROFILE_SAMPLE_RATE sample.
+## Registered only when configured, so normal deployments don't pay for it at all.
+if profiling_service.ENABLED:
+    @app.middleware("http")
+    async def profile_requests(request: Request, call_next):
+        trigger = profiling_service.should_profile(request.headers)
+        if trigger is None:
+            return await call_next(request)
+        with profiling_service.profile_request(request.method, request.url.path, trigger) as profile:
+            response = await call_next(request)
+            profile.status = response.status_code
+        response.headers["X-Profile-Id"] = str(profile.id)
+        return response
+
 ##  CORS Middleware
-print("Adding CORS Middleware...")
+logger.info("Adding CORS Middleware...")
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  ## For development. Restrict in production.
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Profile-Id"],
 )
+## Compress larger bodies (customer lists); small JSON replies aren't worth the CPU
+app.add_middleware(GZipMiddleware, minimum_size = int(os.getenv("GZIP_MIN_BYTES", "1000")))
 
 ##  Health Check Endpoint 
 @app.get("/health")
 def health():
-    print("--- Health Check Endpoint Hit ---")
     return {"status": "ok"}
 
+##  Metrics Endpoint (Prometheus text format)
+@app.get("/metrics", response_class = PlainTextResponse)
+def metrics():
+    return PlainTextResponse(metrics_service.render_prometheus(), media_type = "text/plain; version=0.0.4")
+
 ##  Frontend Endpoints
 
+## Serialized list bodies per endpoint, reused until the data version changes
+_list_bodies = {}
+
+@profiled
+def versioned_list_response(request: Request, name: str, fetch) -> Response:
+    """
+    Serves a customer list with a data-version ETag.
+
+    Returns 304 when the client's If-None-Match still matches the current version,
+    otherwise the cached body for this version (serialized with orjson when available).
+
+    Args:
+        request (Request): Incoming request (for If-None-Match).
+        name (str): Cache key for the list, e.g. "all".
+        fetch (callable): Returns the customers to list (records or dicts).
+    """
+    version = get_db().get_data_version()
+    ## Weak tag: the same version may be served gzipped or not
+    etag = f'W/"{version}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if version >= 0 and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        metrics_service.inc("http_not_modified_total", labels = {"list": name})
+        return Response(status_code = 304, headers = headers)
+
+    cached = _list_bodies.get(name)
+    metrics_service.record_cache("list_body", cached is not None and cached[0] == version)
+    if cached is not None and cached[0] == version:
+        body = cached[1]
+    else:
+        customers = fetch()
+        logger.debug("Retrieved %d customers for %s.", len(customers), name)
+        body = json_dumps({"customers": customers})
+        if version >= 0:
+            _list_bodies[name] = (version, body)
+    return Response(content = body, media_type = "application/json", headers = headers)
+
 @app.get("/all-customers")
-def get_all_customers():
-    """Endpoint to retrieve all customers from the database."""
-    print("GET /all-customers Endpoint Hit.")
+def get_all_customers(request: Request, include_notes: bool = False):
+    """Endpoint to retrieve all customers from the database (transcripts only with include_notes=true)."""
     try:
-        customers = db.fetch_all_customers()
-        print(f"Retrieved {len(customers)} customers.")
-        return {"customers": customers}
+        return versioned_list_response(
+            request, "all:notes" if include_notes else "all",
+            lambda: get_db().list_customers(include_notes = include_notes)
+        )
     except Exception as e:
-        print(f"ERROR in /all-customers: {e}")
+        logger.error("ERROR in /all-customers: %s", e)
         raise HTTPException(status_code=500, detail="Failed to fetch all customers")
 
 @app.get("/pending-customers")
-def get_pending_customers():
-    """Endpoint to retrieve pending customers from the database."""
-    print("GET /pending-customers Endpoint Hit.")
+def get_pending_customers(request: Request, include_notes: bool = False):
+    """Endpoint to retrieve pending customers from the database (transcripts only with include_notes=true)."""
     try:
-        customers = db.fetch_due_customers()
-        print(f"Retrieved {len(customers)} pending customers.")
-        return {"customers": customers}
+        return versioned_list_response(
+            request, "pending:notes" if include_notes else "pending",
+            lambda: get_db().list_customers(status = "Pending", include_notes = include_notes)
+        )
     except Exception as e:
-        print(f"ERROR in /pending-customers: {e}")
+        logger.error("ERROR in /pending-customers: %s", e)
         raise HTTPException(status_code=500, detail="Failed to fetch pending customers")
 
 
+## Short-lived cache so a burst of dashboard loads costs one pair of GROUP BY queries
+SUMMARY_CACHE_SECONDS = float(os.getenv("SUMMARY_CACHE_SECONDS", "5"))
+_summary_cache = {"expires_at": 0.0, "value": None}
+_summary_lock = threading.Lock()
+
+@app.get("/summary")
+def get_summary():
+    """Endpoint for dashboard counts and outstanding amounts per call status and due-date bucket."""
+    with _summary_lock:
+        now = time.monotonic()
+        hit = _summary_cache["value"] is not None and now < _summary_cache["expires_at"]
+        metrics_service.record_cache("summary", hit)
+        if not hit:
+            _summary_cache["value"] = get_db().fetch_summary()
+            _summary_cache["expires_at"] = now + SUMMARY_CACHE_SECONDS
+        return _summary_cache["value"]
+
+
+## Deep pages cost every shard offset + limit ranked hits; past this, refine the query instead
+MAX_SEARCH_OFFSET = 1000
+
+@app.get("/search")
+def search_customers(q: str, limit: int = 20, offset: int = 0):
+    """
+    Endpoint for finding customers by name, phone number or words in their call notes,
+    best match first, one page at a time.
+    """
+    if limit < 1 or limit > 100:
+        raise HTTPException(status_code = 400, detail = "limit must be between 1 and 100")
+    if offset < 0 or offset > MAX_SEARCH_OFFSET:
+        raise HTTPException(status_code = 400, detail = f"offset must be between 0 and {MAX_SEARCH_OFFSET}")
+    ## One extra hit tells whether there is a next page
+    matches = get_db().search_customers(q, limit + 1, offset)
+    body = {
+        "customers": matches[:limit],
+        "offset": offset,
+        "next_offset": offset + limit if len(matches) > limit else None,
+    }
+    return Response(content = json_dumps(body), media_type = "application/json")
+
+
 @app.post("/start-call/{customer_id}")
-async def start_customer_call(customer_id: int):
-    """Endpoint for Frontend to trigger a call to a specific customer."""
-    print(f"POST /start-call/{customer_id} Endpoint Hit ")
+async def start_customer_call(customer_id: int, worker_id: str = OPERATOR_WORKER_ID):
+    """
+    Endpoint for Frontend to trigger a call to a specific customer. Dialers pass the
+    `worker_id` they used for /claim-calls to start calls for the customers they claimed.
+    """
+    bind_customer(customer_id)
     
-    print(f"Fetching customer data for ID: {customer_id}")
-    customer = db.fetch_customer_by_id(customer_id)  ## Corrected function name
+    logger.debug("Fetching customer data for ID: %s", customer_id)
+    customer = get_db().fetch_customer_by_id(customer_id)  ## Corrected function name
 
     if not customer:
-        print(f"ERROR: Customer not found for ID: {customer_id}")
+        logger.warning("Customer not found for ID: %s", customer_id)
         raise HTTPException(status_code = 404, detail = "Customer not found.")
     
     customer_phone = customer.get("phone")
     customer_name = customer.get("name")
-    print(f"Customer found: {customer_name}, Phone: {customer_phone}")
+    logger.debug("Customer found: %s, Phone: %s", customer_name, customer_phone)
 
-    print(f"Validating phone number {customer_phone} using twilio lookup.")
     lookup_result = lookup_number(customer_phone)
-
-    print(f"Twilio Lookup Result: {lookup_result}")
+    logger.debug("Twilio Lookup Result: %s", lookup_result)
 
     if not lookup_result or not lookup_result.get("valid"):
-        print(f"ERROR: Phone number {customer_name} is invalid or lookup failed.")
+        logger.warning("Phone number %s is invalid or lookup failed.", customer_phone)
         raise HTTPException(status_code=400, detail=f"Phone number {customer_phone} is not valid.")
     
     number_type = lookup_result.get("type", "unknown")
     if number_type != 'mobile':
         # Log a warning instead of raising an error
-        print(f"WARNING: Phone number {customer_phone} is not 'mobile' (Type: {number_type}). Proceeding anyway.")
-    
-    print(f"Phone number {customer_phone} validated successfully. (Type: {number_type})")
+        logger.warning("Phone number %s is not 'mobile' (Type: %s). Proceeding anyway.", customer_phone, number_type)
     
+    ## Reserve the customer so no dialer or other operator calls them at the same time
+    if not get_db().claim_customer(customer_id, worker_id):
+        logger.warning("Customer %s is already being called", customer_id)
+        raise HTTPException(status_code = 409, detail = "Customer is already being called.")
+
     try:
 
-        print(f"Calling vapi_service.start_phone_call for {customer_name} at {customer_phone}")
+        logger.info("Starting Vapi call for %s at %s", customer_name, customer_phone)
         call_data = vapi_service.start_phone_call(customer_phone = customer_phone)
-        print(f"Vapi call initiated successfully. Response: {call_data}")
+        logger.debug("Vapi call initiated successfully.", extra = {"call_data": call_data})
+
+        ## Bind the Vapi call id to this customer so webhook turns resolve it without a phone lookup
+        vapi_call_id = call_data.get("id") if isinstance(call_data, dict) else None
+        if vapi_call_id:
+            snapshot = {key: customer.get(key) for key in CALL_CONTEXT_FIELDS}
+            remember_call_context(vapi_call_id, snapshot)
+            get_db().save_call_binding(vapi_call_id, snapshot)
 
         return {"status": "success", "message": f"Call initiated to {customer_name}", "call_data": call_data}
     except Exception as e:
-        print(f"ERROR during Vapi call initiation for customer {customer_id}: {e}")
+        logger.error("ERROR during Vapi call initiation for customer %s: %s", customer_id, e)
+        get_db().release_claim(customer_id, retry_now = True)
         raise HTTPException(status_code = 500, detail = str(e))
+
+
+@app.get("/events")
+async def events(request: Request, last_event_id: str | None = None):
+    """
+    Server-Sent Events stream of customer_added, status_changed, sms_sent and call_ended events.
+    Reconnecting clients send Last-Event-ID (EventSource does this itself) to resume without gaps;
+    the id is one last-seen event id per shard, e.g. "12.0.7".
+    """
+    header = request.headers.get("last-event-id")
+    if header:
+        last_event_id = header
+    return StreamingResponse(
+        event_broker.stream(last_event_id),
+        media_type = "text/event-stream",
+        headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def require_admin(request: Request):
+    """Rejects requests without the ADMIN_TOKEN (sent as X-Admin-Token)."""
+    if not profiling_service.is_admin(request.headers.get("x-admin-token")):
+        raise HTTPException(status_code = 403, detail = "Admin token required.")
+
+
+@app.get("/admin/profiles")
+def list_request_profiles(request: Request):
+    """Endpoint listing the buffered request profiles, newest first."""
+    require_admin(request)
+    return {"profiles": profiling_service.list_profiles()}
+
+
+@app.get("/admin/profiles/{profile_id}")
+def get_request_profile(request: Request, profile_id: int, sort: str = "cumulative", limit: int = 40):
+    """Endpoint returning one request profile as a pstats text report."""
+    require_admin(request)
+    if sort not in ("cumulative", "tottime", "calls", "ncalls"):
+        raise HTTPException(status_code = 400, detail = "sort must be cumulative, tottime or calls")
+    profile = profiling_service.get_profile(profile_id)
+    if profile is None:
+        raise HTTPException(status_code = 404, detail = "Profile not found (it may have left the buffer).")
+    return PlainTextResponse(profile.render(sort, max(1, min(limit, 500))))
+
+
+@app.get("/admin/conversations")
+def export_conversations(request: Request, customer_id: int | None = None, since: str | None = None, until: str | None = None):
+    """
+    Endpoint streaming archived call dialogues as NDJSON (one call per line, oldest first),
+    optionally for one customer and an ended_at range (UTC, "YYYY-MM-DD[ HH:MM:SS]").
+    Archives are read page by page and decompressed one at a time.
+    """
+    require_admin(request)
+
+    def lines():
+        for archive_id, call_id, archived_customer, started_at, ended_at, turns, transcript in \
+                get_db().iter_conversations(customer_id, since, until):
+            yield json_dumps({
+                "id": archive_id,
+                "call_id": call_id,
+                "customer_id": archived_customer,
+                "started_at": started_at,
+                "ended_at": ended_at,
+                "turn_count": turns,
+                "turns": decode_turns(transcript),
+            }) + b"\n"
+
+    return StreamingResponse(lines(), media_type = "application/x-ndjson")
+
+
+@app.post("/claim-calls")
+def claim_calls(worker_id: str, limit: int = 10):
+    """
+    Endpoint for dialers: atomically reserves up to `limit` customers due for a call
+    (callable status, next attempt time passed, inside calling hours).
+    """
+    if limit < 1 or limit > 100:
+        raise HTTPException(status_code = 400, detail = "limit must be between 1 and 100")
+    customers = get_db().claim_callable_customers(worker_id, limit)
+    return {"customers": customers}
     
 
+async def resolve_call_customer(call_id: str, call_info: dict) -> dict | None:
+    """
+    Finds the customer for a webhook turn.
+
+    Outbound calls are resolved through the call id bound in /start-call (in-process
+    cache first, then the call_bindings table, which is shared by all workers).
+    Only calls we didn't dial (inbound) fall back to a lookup by the caller's number.
+    """
+    customer_data = call_contexts.get(call_id)
+    metrics_service.record_cache("call_context", customer_data is not None)
+    if customer_data:
+        call_contexts.move_to_end(call_id)
+        return customer_data
+
+    customer_data = await asyncio.to_thread(get_db().get_call_binding, call_id)
+    if not customer_data:
+        customer_phone = call_info.get('customer', {}).get('number')
+        if not customer_phone:
+            return None
+        customer = await asyncio.to_thread(get_db().get_customer_by_phone, customer_phone)
+        if not customer:
+            return None
+        customer_data = {key: customer.get(key) for key in CALL_CONTEXT_FIELDS}
+
+    remember_call_context(call_id, customer_data)
+    return customer_data
+
+_last_stale_sweep = 0.0
+STALE_SWEEP_SECONDS = 600
+
+async def archive_stale_conversations():
+    """Every STALE_SWEEP_SECONDS, archives live calls whose call-end never arrived."""
+    global _last_stale_sweep
+    if time.time() - _last_stale_sweep < STALE_SWEEP_SECONDS:
+        return
+    _last_stale_sweep = time.time()
+    archived = await asyncio.to_thread(get_db().archive_stale_conversations, STALE_AFTER_SECONDS)
+    if archived:
+        logger.info("Archived %d stale conversations", archived)
+
+def remember_call_context(call_id: str, customer_data: dict):
+    """Caches a call's customer snapshot, evicting the least recently used calls beyond CALL_CONTEXT_CACHE_SIZE."""
+    call_contexts[call_id] = customer_data
+    call_contexts.move_to_end(call_id)
+    while len(call_contexts) > CALL_CONTEXT_CACHE_SIZE:
+        call_contexts.popitem(last = False)
+
+@profiled
+def analyze_turn(turn, customer_data: dict, history: list) -> tuple[str, dict] | None:
+    """
+    Runs sentiment and intent classification for a turn (in a worker thread).
+    Stops before the intent LLM call if a newer transcript has superseded the turn.
+    """
+    ## Both agents share one latency budget and fall back to local classifiers when it runs out
+    with turn_budget():
+        with timer("webhook_stage_seconds", stage = "sentiment"):
+            sentiment = get_sentiment_agent().analyze_sentiment(turn.transcript)
+        logger.debug("Sentiment Analysis Result: %s", sentiment)
+
+        if not turn_coordinator.is_current(turn):
+            return None
+
+        with timer("webhook_stage_seconds", stage = "dialogue"):
+            action_plan = get_dialogue_agent().get_next_action(turn.transcript, customer_data, history, sentiment = sentiment)
+    return sentiment, action_plan
+
 @app.post("/webhook/vapi")
 async def handle_vapi_webhook(request_body: dict):
     """
     This is the main webhook that Vapi calls during the live conversation.
     """
-    print("POST /webhook/vapi Endpoint Hit.")
-    # print(f"Received Vapi Webhook Body:\n{json.dumps(request_body, indent=2)}") # Uncomment for very detailed logs
+    call_id = request_body.get('call', {}).get('id', 'unknown_call')
+    bind_call(call_id)
+    ## Vapi re-sends a message it timed out on; a retry gets the first attempt's reply instead of re-running the turn
+    key = message_key(call_id, request_body.get('message', {}))
+    return await webhook_dedupe.run(key, process_vapi_message, request_body)
+
 
+async def process_vapi_message(request_body: dict):
+    """Handles one Vapi webhook message (once per delivery, see handle_vapi_webhook)."""
     message_type = request_body.get('message', {}).get('type')
     call_info = request_body.get('call', {})
     call_id = call_info.get('id', 'unknown_call')
 
-    print(f"Webhook Call ID: {call_id}, Message Type: {message_type}")
+    logger.debug("Webhook message type: %s", message_type)
 
     if message_type == 'transcript' and request_body['message']['role'] == 'user':
         transcript = request_body['message']['transcript']
-        print(f"Call ID {call_id} - User Transcript: '{transcript}'")
+        logger.info("User transcript received", extra = {"transcript": transcript})
 
-        customer_phone = call_info.get('customer', {}).get('number')
-        if not customer_phone:
-            print(f"ERROR: No customer phone number in Vapi webhook for Call ID {call_id}")
-            return {"reply": "Sorry, I couldn't identify your number."}
-
-        print(f"Call ID {call_id} - Fetching customer data for phone: {customer_phone}")
-        customer_data = db.get_customer_by_phone(customer_phone)
+        with timer("webhook_stage_seconds", stage = "customer_lookup"):
+            customer_data = await resolve_call_customer(call_id, call_info)
 
         if not customer_data:
-            print(f"ERROR: Customer with phone {customer_phone} not found for Call ID {call_id}")
+            caller_number = call_info.get('customer', {}).get('number')
+            if not caller_number:
+                logger.error("Unbound call with no customer phone number in Vapi webhook")
+                return {"reply": "Sorry, I couldn't identify your number."}
+            logger.error("Customer with phone %s not found", caller_number)
             return {"reply": "Sorry, I can't find your details in our system."}
         
+        customer_phone = customer_data.get('phone') or call_info.get('customer', {}).get('number')
         customer_id_internal = customer_data.get('id')
-        print(f"Call ID {call_id} - Found Customer ID: {customer_id_internal}")
-
-        ## Sentiment Feature 
-        print(f"Call ID {call_id} - Analyzing sentiment for transcript")
-        sentiment = sentiment_agent.analyze_sentiment(transcript)
-        print(f"Call ID {call_id} - Sentiment Analysis Result: {sentiment}")
+        bind_customer(customer_id_internal)
+
+        ## Merge fragments that arrive within the debounce window; only the latest request answers
+        turn = await turn_coordinator.collect(call_id, transcript)
+        if turn is None:
+            logger.debug("Transcript fragment merged into a newer turn")
+            return {}
+        transcript = turn.transcript
+
+        ## Sentiment + intent, cancelled if the caller keeps talking
+        ## The dialogue so far is shared in the database: earlier turns may have been handled by other workers
+        current_history = history_lines(await asyncio.to_thread(get_db().fetch_call_turns, call_id)) + [f"User: {transcript}"]
+        result = await turn_coordinator.run(turn, analyze_turn, turn, customer_data, current_history)
+        if result is None:
+            logger.debug("Turn superseded by a newer transcript while in flight")
+            return {}
+        sentiment, action_plan = result
+        await turn_coordinator.complete(turn)
 
-        ## Memory Feature
-        conversation_histories[call_id].append(f"User: {transcript}")
-        current_history = conversation_histories[call_id]
-        print(f"Call ID {call_id} - Current History Length: {len(current_history)}")
+        intent = action_plan.get("intent", "UNCLEAR")
 
-        print(f"Call ID {call_id} - Calling dialogue_agent.get_next_action.(with sentiment analysis)")
-        action_plan = dialogue_agent.get_next_action(transcript, customer_data, current_history, sentiment = sentiment)
-        print(f"Call ID {call_id} - Received Action Plan:\n{json.dumps(action_plan, indent=2)}")
+        ## Memory Feature: this turn's lines, stored together once the reply is decided
+        new_turns = [Turn_record("User", transcript, intent, sentiment)]
+        logger.debug("Current History Length: %d", len(current_history))
+        ## The plan dict is only serialized by the background log writer, and only when DEBUG is enabled
+        logger.debug("Received Action Plan", extra = {"action_plan": action_plan})
 
         response_to_vapi = {}
-        intent = action_plan.get("intent", "UNCLEAR")
 
         if action_plan.get("action") == "SEQUENCE":
-            print(f"Call ID {call_id} - Processing SEQUENCE action...")
             for i, action in enumerate(action_plan.get("payload", [])):
                 action_type = action.get("type")
-                print(f"Call ID {call_id} - Sequence Step {i+1}: Type={action_type}")
+                logger.debug("Sequence Step %d: Type=%s", i + 1, action_type)
 
                 if action_type == "REPLY":
                     reply_text = action.get("text")
                     response_to_vapi['reply'] = reply_text
-                    conversation_histories[call_id].append(f"Agent: {reply_text}")
-                    print(f"Call ID {call_id} - Added REPLY to Vapi response.")
+                    new_turns.append(Turn_record("Agent", reply_text))
 
                 elif action_type == "SEND_SMS":
-                    print(f"Call ID {call_id} - Calling action_agent to SEND_SMS...")
-                    sms_success = action_agent.execute_action(action, customer_phone)
-                    print(f"Call ID {call_id} - SMS Action Success: {sms_success}")
+                    with timer("webhook_stage_seconds", stage = "send_sms"):
+                        sms_success = await asyncio.to_thread(get_action_agent().execute_action, action, customer_phone)
+                    logger.info("SMS Action Success: %s", sms_success)
                     if sms_success:
-                        print(f"Call ID {call_id} - Logging SMS_SENT to DB for customer {customer_id_internal}...")
-                        db.log_call_outcome(customer_id_internal, "SMS_SENT", action.get("message"))
+                        await asyncio.to_thread(get_db().log_call_outcome, customer_id_internal, "SMS_SENT", action.get("message"))
+                        await asyncio.to_thread(
+                            get_db().record_event, "sms_sent", customer_id_internal, {"call_id": call_id, "message": action.get("message")}
+                        )
 
                 elif action_type == "END_CALL":
                     end_text = action.get("text")
                     response_to_vapi = {"endCall": True, "endCallMessage": end_text}
-                    conversation_histories[call_id].append(f"Agent: {end_text}")
-                    print(f"Call ID {call_id} - Added END_CALL to Vapi response. Breaking sequence.")
+                    new_turns.append(Turn_record("Agent", end_text))
                     break # Stop processing sequence after END_CALL
 
         elif action_plan.get("action") == "END_CALL":
             text = action_plan['payload']['text']
             response_to_vapi = {"endCall": True, "endCallMessage": text}
-            conversation_histories[call_id].append(f"Agent: {text}")
-            print(f"Call ID {call_id} - Added END_CALL (standalone) to Vapi response.")
+            new_turns.append(Turn_record("Agent", text))
 
         elif action_plan.get("action") == "REPLY":
             text = action_plan['payload']['text']
             response_to_vapi['reply'] = text
-            conversation_histories[call_id].append(f"Agent: {text}")
-            print(f"Call ID {call_id} - Added REPLY (standalone) to Vapi response.")
+            new_turns.append(Turn_record("Agent", text))
 
-        print(f"Call ID {call_id} - Final response to Vapi:\n{json.dumps(response_to_vapi, indent=2)}")
+        await asyncio.to_thread(get_db().append_call_turns, call_id, customer_id_internal, new_turns)
+        logger.info("Turn handled", extra = {"intent": intent, "sentiment": sentiment, "action": action_plan.get("action")})
+        logger.debug("Final response to Vapi", extra = {"response": response_to_vapi})
         return response_to_vapi
     
     elif message_type == 'call-end':
-        print(f"Call ID {call_id} - Received 'call-end' event.")
-        if call_id in conversation_histories:
-            del conversation_histories[call_id]
-            print(f"Call ID {call_id} - Cleaned up conversation history.")
+        logger.info("Received 'call-end' event.")
+        customer_data = call_contexts.pop(call_id, None) or await asyncio.to_thread(get_db().get_call_binding, call_id)
+        await turn_coordinator.end_call(call_id)
+        ## The whole dialogue moves from conversation_turns to the archive as one compressed row
+        with timer("webhook_stage_seconds", stage = "archive"):
+            await asyncio.to_thread(get_db().archive_conversation, call_id, customer_data.get("id") if customer_data else None)
+            await archive_stale_conversations()
+        ## Calls that ended without an outcome are retried later instead of staying claimed
+        if customer_data and customer_data.get("id") is not None:
+            await asyncio.to_thread(get_db().release_claim, customer_data["id"])
+        await asyncio.to_thread(get_db().record_event, "call_ended", customer_data.get("id") if customer_data else None, {"call_id": call_id})
+        await asyncio.to_thread(get_db().delete_call_binding, call_id)
         return {}
     
     else:
-        print(f"Call ID {call_id} - Received unhandled message type: {message_type}")
+        logger.debug("Received unhandled message type: %s", message_type)
         return {}
 
 
@@ -254,74 +637,58 @@ async def upload_recording(customer_id: int, file: UploadFile = File(...)):
     """
     Endpoint to upload the recording... (rest of docstring)
     """
-    print(f"POST /upload-recording/{customer_id} Endpoint Hit.")
+    bind_customer(customer_id)
     
-    print(f"Fetching customer data for ID: {customer_id}")
-    customer_data = db.fetch_customer_by_id(customer_id) ## Use correct function name
+    customer_data = get_db().fetch_customer_by_id(customer_id) ## Use correct function name
 
     if not customer_data:
-        print(f"ERROR: Customer not found for ID: {customer_id}")
+        logger.warning("Customer not found for ID: %s", customer_id)
         raise HTTPException(status_code = 404, detail = "Customer not found.")
     
-    print(f"Customer found: {customer_data.get('name')}")
     temp_path = None
 
     try:
         ## Create temp file path
         with tempfile.NamedTemporaryFile(delete = False, suffix = ".wav") as tmp_file:
             temp_path = tmp_file.name
-        print(f"Created temporary file: {temp_path}")
 
         ## Asynchronously write uploaded file content to temp file
-        print(f"Writing uploaded file '{file.filename}' to temporary file...")
+        logger.debug("Writing uploaded file '%s' to %s", file.filename, temp_path)
         async with aiofiles.open(temp_path, 'wb') as out_file:
             content = await file.read()
             await out_file.write(content)
-        print(f"Finished writing to temporary file.")
 
         ## Transcribing audio
-        print(f"Calling transcription_service for file: {temp_path}")
         transcript = transcription_service.transcribe_audio_file(temp_path)
-        print(f"Transcription result: '{transcript}'")
+        logger.info("Transcription complete", extra = {"transcript": transcript})
         if transcript.startswith("[") and transcript.endswith("]"):
-            print(f"ERROR: Transcription failed for customer {customer_id}. Detail: {transcript}")
+            logger.error("Transcription failed. Detail: %s", transcript)
             raise HTTPException(status_code = 500, detail = transcript)
         
         ## Get action plan from agent 
-        print(f"Calling dialogue_agent.get_next_action for customer {customer_id}...")
-        action_plan = dialogue_agent.get_next_action(transcript, customer_data)
-        print(f"Received Action Plan:\n{json.dumps(action_plan, indent=2)}")
+        action_plan = get_dialogue_agent().get_next_action(transcript, customer_data)
+        logger.debug("Received Action Plan", extra = {"action_plan": action_plan})
 
         intent = action_plan.get("intent", "UNCLEAR")
-        final_db_status = "UNCLEAR"
-        
-        if intent == "AGREES_TO_PAY":
-            final_db_status = "SUCCESSFUL"
-        elif intent == "REFUSES_TO_PAY":
-            final_db_status = "NEEDS FOLLOW-UP"
-        
-        print(f"Determined Final DB Status: {final_db_status}")
+        final_db_status = call_status_for_intent(intent)
+        logger.info("Determined Final DB Status: %s", final_db_status)
 
         ## Log outcome to database
-        print(f"Logging outcome to DB for customer {customer_id}...")
-        db.log_call_outcome(customer_id, final_db_status, transcript)
-        print(f"DB logging complete.")
+        get_db().log_call_outcome(customer_id, final_db_status, transcript, intent = intent)
 
         ## Execute actions if needed
         actions_executed = []
         if action_plan.get("action") == "SEQUENCE":
-            print(f"Processing SEQUENCE action for customer {customer_id}...")
             for i, action in enumerate(action_plan.get("payload", [])):
                 action_type = action.get("type")
-                print(f"Upload Sequence Step {i+1}: Type={action_type}")
+                logger.debug("Upload Sequence Step %d: Type=%s", i + 1, action_type)
                 if action_type == "SEND_SMS":
-                    print(f"Calling action_agent to SEND_SMS for customer {customer_id}...")
-                    sms_success = action_agent.execute_action(action, customer_data.get("phone"))
-                    print(f"SMS Action Success: {sms_success}")
+                    sms_success = get_action_agent().execute_action(action, customer_data.get("phone"))
+                    logger.info("SMS Action Success: %s", sms_success)
                     if sms_success:
                         actions_executed.append(action)
+                        get_db().record_event("sms_sent", customer_id, {"message": action.get("message")})
         
-        print(f"Returning success response for customer {customer_id}.")
         return {
             "status": "success",
             "customerId": customer_id,
@@ -333,30 +700,27 @@ async def upload_recording(customer_id: int, file: UploadFile = File(...)):
         }
     
     except Exception as e:
-        print(f"ERROR in /upload-recording for customer {customer_id}: {e}")
-        ## Log the full traceback for detailed debugging if needed
+        ## Log the full traceback for detailed debugging
+        logger.exception("ERROR in /upload-recording for customer %s: %s", customer_id, e)
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         ## Clean up the temporary file
         if temp_path and os.path.exists(temp_path):
-            print(f"Cleaning up temporary file: {temp_path}")
             try:
                 os.remove(temp_path)
-                print("Temporary file removed.")
             except Exception as remove_err:
-                print(f"ERROR removing temporary file {temp_path}: {remove_err}")
+                logger.error("ERROR removing temporary file %s: %s", temp_path, remove_err)
 
 @app.post("/add-customer")
 async def add_new_customer(customer: CustomerCreate):
     """
     EndPoint to add new customer
     """
-    print("--- POST /add-customer Endpoint Hit ---")
-    print(f"Received new customer data: {customer}")
+    logger.debug("Received new customer data: %s", customer)
 
     due_date_str = customer.due_date.strftime('%Y-%m-%d')
 
-    new_id = db.add_customer(
+    new_id = get_db().add_customer(
         name=customer.name,
         phone=customer.phone,
         due_date=due_date_str,
@@ -364,11 +728,13 @@ async def add_new_customer(customer: CustomerCreate):
     )
 
     if new_id is not None:
-        print(f"Successfully added customer with ID: {new_id}")
+        logger.info("Successfully added customer with ID: %s", new_id)
         ## Return the ID and a success message
         return {"status": "success", "message": f"Customer '{customer.name}' added successfully.", "customerId": new_id}
     else:
-        print("ERROR: Failed to add customer to the database.")
+        logger.error("Failed to add customer to the database.")
         raise HTTPException(status_code=500, detail="Failed to add customer to the database.")
 
-print("FastAPI App Defined")
\ No newline at end of file
+import_seconds = time.perf_counter() - _import_started
+metrics_service.set_gauge("app_import_seconds", import_seconds, aggregate = "max")
+logger.info("FastAPI App Defined in %.3fs", import_seconds)
\ No newline at end of file
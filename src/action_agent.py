@@ -1,4 +1,9 @@
+import logging
+
 from src.services import mcp_service
+from src.services.metrics_service import timer
+
+logger = logging.getLogger(__name__)
 
 class Action_agent:
     """
@@ -10,7 +15,7 @@ class Action_agent:
     """
 
     def __init__(self):
-        print(" Action_agent initialized.")
+        logger.info("Action_agent initialized.")
 
     def execute_action(self, action_plan: dict, customer_phone: str) -> bool | dict | None:
         """
@@ -29,12 +34,14 @@ class Action_agent:
 
         if action_type == "SEND_SMS":
             message = action_plan.get("message", "You have a new message.")
-            return self._send_sms(customer_phone, message)
+            with timer("action_seconds", action = action_type):
+                return self._send_sms(customer_phone, message)
 
         elif action_type == "LOOKUP_NUMBER":
-            return self._lookup_number(customer_phone)
+            with timer("action_seconds", action = action_type):
+                return self._lookup_number(customer_phone)
         else:
-            print(f"Unknown action type: {action_type}")
+            logger.warning("Unknown action type: %s", action_type)
             return False
         
     def _send_sms(self, to_number: str, message: str) -> bool:
@@ -43,7 +50,7 @@ class Action_agent:
         It calls the mcp_service to do the actual work.
         """
 
-        print(f"ActionAgent: Executing send_sms to {to_number}")
+        logger.debug("ActionAgent: Executing send_sms to %s", to_number)
 
         success = mcp_service.send_sms(to_number, message)
         return success
@@ -54,7 +61,7 @@ class Action_agent:
         It calls the mcp_service to do the actual work.
         """
 
-        print(f"ActionAgent: Executing lookup_number for {phone_number}")
+        logger.debug("ActionAgent: Executing lookup_number for %s", phone_number)
 
         info = mcp_service.lookup_number(phone_number)
         return info
@@ -1,46 +1,549 @@
 import sqlite3
+import json
+import logging
 import os
+import heapq
+import itertools
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from dataclasses import dataclass, fields
 from datetime import datetime, timedelta
+from operator import attrgetter, itemgetter
 import random
+import re
+
+from src.services.metrics_service import timed
+from src.services import call_schedule, conversation_archive
+
+logger = logging.getLogger(__name__)
+
+## Columns added to `customers` after the original schema, applied in order to older files:
+## (column, definition, optional statement that backfills existing rows)
+CUSTOMER_MIGRATIONS = (
+    ("intent", "VARCHAR DEFAULT NULL", None),
+    ## Call scheduling: NULL next_attempt_at means "don't call again"; a claim sets it to the lease expiry
+    ("next_attempt_at", "TIMESTAMP DEFAULT '1970-01-01 00:00:00'",
+     f"UPDATE customers SET next_attempt_at = COALESCE(datetime(due_date, '-{call_schedule.LEAD_DAYS} days'), next_attempt_at)"),
+    ("attempts", "INTEGER NOT NULL DEFAULT 0", None),
+    ("locked_by", "VARCHAR DEFAULT NULL", None),
+    ("locked_at", "TIMESTAMP DEFAULT NULL", None),
+)
+
+## Customers are spread over shard files in this many fixed virtual buckets. A customer's
+## bucket is `id % NUM_BUCKETS`; new ids are chosen so that it equals the bucket of their phone.
+## Rebalancing moves whole buckets between files, so ids never change.
+NUM_BUCKETS = 64
+
+## Call bindings older than this belong to calls that never sent call-end and are pruned
+CALL_BINDING_TTL_SECONDS = int(os.getenv("CALL_BINDING_TTL_HOURS", "6")) * 3600
+
+
+@dataclass(slots=True)
+class Customer_record:
+    """
+    One customer as listed by the API. Built straight from a projected row tuple (no
+    per-row dict) and serialised by orjson natively. The potentially large `notes`
+    transcript is not part of it; see Customer_detail.
+    """
+    id: int
+    name: str
+    phone: str
+    due_date: str
+    loan_amount: float
+    call_status: str
+    intent: str | None
+    attempts: int
+    next_attempt_at: str | None
+
+
+@dataclass(slots=True)
+class Customer_detail(Customer_record):
+    """Customer_record plus the stored call transcript."""
+    notes: str
+
+
+@dataclass(slots=True)
+class Customer_match(Customer_record):
+    """A search result: the customer, a highlighted excerpt of the matching notes and its bm25 score (lower is better)."""
+    snippet: str
+    score: float
+
+
+## Column lists for the record types, in constructor order (built once, reused by every query)
+LIST_COLUMNS = ", ".join(field.name for field in fields(Customer_record))
+DETAIL_COLUMNS = ", ".join(field.name for field in fields(Customer_detail))
+
+
+## Phone text given to the search index: the stored number plus its last 10 digits, so a
+## national number typed without the country code still prefix-matches
+SEARCH_PHONE = "{row}.phone || ' ' || substr({row}.phone, -10)"
+## bm25 column weights: a name hit outranks a phone hit, which outranks a transcript mention
+SEARCH_WEIGHTS = "10.0, 5.0, 1.0"
+SEARCH_MAX_TERMS = 8
+_SEARCH_TERM = re.compile(r"\w+")
+
+
+def search_expression(text: str) -> str | None:
+    """
+    Turns free text typed by a user into an FTS5 query: every word becomes a quoted
+    prefix term and all of them must match. FTS5 operators and punctuation in the input
+    are never interpreted, so no input can produce a syntax error.
+
+    Returns:
+        str | None: The MATCH expression, or None if `text` contains no searchable word.
+    """
+    terms = _SEARCH_TERM.findall(text.lower())[:SEARCH_MAX_TERMS]
+    if not terms:
+        return None
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def phone_bucket(phone: str) -> int:
+    """Virtual bucket for a phone number (formatting characters are ignored)."""
+    digits = "".join(ch for ch in phone if ch.isdigit()) or phone
+    return zlib.crc32(digits.encode()) % NUM_BUCKETS
+
+
+def shard_file(db_file: str, index: int) -> str:
+    """Path of shard `index`: shard 0 is `db_file` itself, others are e.g. customers.shard1.db."""
+    if index == 0:
+        return db_file
+    root, ext = os.path.splitext(db_file)
+    return f"{root}.shard{index}{ext}"
+
 
 class Database:
-    def __init__(self, db_file="customers.db"):
+    def __init__(self, db_file="customers.db", seed=False, shards=None):
+        """
+        Opens (and creates if needed) the customer database.
+
+        Customers can be split over several SQLite files (shards) so that writes for
+        different customers don't queue on one file's write lock. Shard 0 is `db_file`;
+        it also holds the bucket -> shard map and the call bindings. With one shard (the
+        default) everything stays in `db_file` exactly as before.
+
+        Args:
+            db_file (str): Path to the SQLite file.
+            seed (bool): Insert sample customers when the table is empty. Off by default so
+                         that worker startup never pays for Faker; enable it for demos with
+                         SEED_DATABASE=1 or run `python -m src.database --seed`.
+            shards (int, optional): Shard count for a new database (default DB_SHARDS or 1).
+                                    Existing databases keep their stored layout; change it
+                                    with `python -m src.rebalance_shards`.
+        """
         self.db_file = db_file
         self.con = None
+        self.shards = []
+        self.bucket_shard = [0] * NUM_BUCKETS
+        self._write_locks = []
         try:
-            self.con = sqlite3.connect(db_file, check_same_thread=False)
+            self.con = self._open_shard(0)
             self.create_table()
-            print(f"✓ Database initialized: {db_file}")
-            
-            # Only seed if no data exists
-            if not self.fetch_due_customers():
+            self._load_shard_map(shards or int(os.getenv("DB_SHARDS", "1")))
+            logger.info("Database initialized: %s (%d shard(s))", db_file, len(self.shards))
+
+            # Only seed if asked to and no data exists
+            if seed and not any(con.execute("SELECT 1 FROM customers LIMIT 1").fetchone() for con in self.shards):
                 self.seed_data()
-                print("✓ Database seeded with sample data")
-                
+                logger.info("Database seeded with sample data")
+
         except Exception as e:
-            print(f"✗ Database initialization failed: {e}")
+            logger.error("Database initialization failed: %s", e)
             raise
 
+    @property
+    def sharded(self) -> bool:
+        return len(self.shards) > 1
+
+    def _open_shard(self, index: int) -> sqlite3.Connection:
+        """Connects to shard `index` (creating its customer tables) and registers it."""
+        con = sqlite3.connect(shard_file(self.db_file, index), check_same_thread=False)
+        self.shards.append(con)
+        self._write_locks.append(threading.Lock())
+        with self._transaction(index):
+            self._create_customer_schema(con)
+        return con
+
+    @contextmanager
+    def _transaction(self, index: int = 0):
+        """
+        Write transaction on shard `index`; every write to a shard goes through here.
+
+        A shard's connection is shared by all threads of the process, so the shard's lock
+        keeps one thread's statements (or its commit) from landing inside another thread's
+        transaction. BEGIN IMMEDIATE takes SQLite's write lock up front, so writers in other
+        processes wait their turn instead of failing halfway through.
+        """
+        con = self.shards[index]
+        with self._write_locks[index]:
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                yield con
+            except BaseException:
+                con.rollback()
+                raise
+            con.commit()
+
+    def _load_shard_map(self, shard_count: int):
+        """Reads the bucket -> shard map from shard 0 (creating it for a new database) and opens every shard."""
+        rows = self.con.execute("SELECT bucket, shard FROM shard_map").fetchall()
+        if not rows:
+            rows = [(bucket, bucket % shard_count) for bucket in range(NUM_BUCKETS)]
+            with self._transaction(0):
+                self.con.executemany("INSERT OR IGNORE INTO shard_map (bucket, shard) VALUES (?, ?)", rows)
+        for bucket, shard in rows:
+            self.bucket_shard[bucket] = shard
+        while len(self.shards) <= max(self.bucket_shard):
+            self._open_shard(len(self.shards))
+        if shard_count != len(self.shards) and os.getenv("DB_SHARDS"):
+            logger.warning("DB_SHARDS=%s but the database has %d shard(s); run src.rebalance_shards to change it",
+                           os.getenv("DB_SHARDS"), len(self.shards))
+
+    def _shard_index_for_id(self, customer_id) -> int:
+        return self.bucket_shard[int(customer_id) % NUM_BUCKETS]
+
+    def _shard_for_id(self, customer_id) -> sqlite3.Connection:
+        return self.shards[self._shard_index_for_id(customer_id)]
+
+    def _shards_for_phone(self, phone: str) -> list[sqlite3.Connection]:
+        """Shards to search for a phone number: its bucket's shard first, then the rest."""
+        home = self.bucket_shard[phone_bucket(phone)]
+        return [self.shards[home]] + [con for i, con in enumerate(self.shards) if i != home]
+
+    @staticmethod
+    def _fetch_dicts(con, query, params=()) -> list[dict]:
+        cur = con.execute(query, params)
+        rows = cur.fetchall()
+        # Get the column names from the cursor's description
+        keys = [description[0] for description in cur.description]
+        # Create a list of dictionaries by zipping the keys with each row's values
+        return [dict(zip(keys, row)) for row in rows]
+
     def create_table(self):
         """Create the table if not exists"""
         try:
-            query = """
-                CREATE TABLE IF NOT EXISTS customers(
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name VARCHAR NOT NULL,
-                    phone VARCHAR NOT NULL,
-                    due_date DATE NOT NULL,
-                    loan_amount REAL NOT NULL,
-                    call_status VARCHAR DEFAULT 'Pending',
-                    notes VARCHAR DEFAULT ''
-                    )
-                """
-            self.con.execute(query)
-            self.con.commit()
+            for index, con in enumerate(self.shards):
+                with self._transaction(index):
+                    self._create_customer_schema(con)
+            with self._transaction(0):
+                self._create_home_tables()
         except Exception as e:
-            print(f"Error creating table: {e}")
+            logger.error("Error creating table: %s", e)
             raise
 
+    def _create_home_tables(self):
+        """Creates the tables that only live on shard 0 (call bindings, shard map, live-call state, conversations)."""
+        ## Vapi call id -> customer, written when we dial so webhook turns don't need a phone lookup
+        self.con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS call_bindings(
+                call_id VARCHAR PRIMARY KEY,
+                customer_id INTEGER NOT NULL,
+                name VARCHAR,
+                phone VARCHAR,
+                due_date DATE,
+                loan_amount REAL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                ) WITHOUT ROWID
+            """
+        )
+        self.con.execute("CREATE INDEX IF NOT EXISTS idx_call_bindings_created ON call_bindings(created_at)")
+        ## Which shard file holds each virtual bucket
+        self.con.execute(
+            "CREATE TABLE IF NOT EXISTS shard_map(bucket INTEGER PRIMARY KEY, shard INTEGER NOT NULL)"
+        )
+        ## Vapi webhook deliveries already taken by a worker; response stays NULL until the first attempt finishes
+        self.con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS webhook_deliveries(
+                key VARCHAR PRIMARY KEY,
+                response TEXT,
+                created_at REAL NOT NULL
+                ) WITHOUT ROWID
+            """
+        )
+        self.con.execute("CREATE INDEX IF NOT EXISTS idx_webhook_deliveries_created ON webhook_deliveries(created_at)")
+        ## Live-call turn state shared by all workers: the newest transcript generation of each call
+        ## and the user fragments not yet answered (see Turn_coordinator)
+        self.con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS call_turns(
+                call_id VARCHAR PRIMARY KEY,
+                generation INTEGER NOT NULL,
+                updated_at REAL NOT NULL
+                ) WITHOUT ROWID
+            """
+        )
+        self.con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS turn_fragments(
+                call_id VARCHAR NOT NULL,
+                generation INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                PRIMARY KEY (call_id, generation)
+                ) WITHOUT ROWID
+            """
+        )
+        ## Turns of live calls, appended by whichever worker handled the webhook; moved to the archive at call end
+        self.con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS conversation_turns(
+                call_id VARCHAR NOT NULL,
+                seq INTEGER NOT NULL,
+                customer_id INTEGER,
+                role VARCHAR NOT NULL,
+                text TEXT NOT NULL,
+                intent VARCHAR,
+                sentiment VARCHAR,
+                ts REAL NOT NULL,
+                PRIMARY KEY (call_id, seq)
+                ) WITHOUT ROWID
+            """
+        )
+        ## Finished live-call dialogues, one zlib-compressed JSON blob per call (audit trail)
+        self.con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS conversation_archive(
+                id INTEGER PRIMARY KEY,
+                call_id VARCHAR NOT NULL UNIQUE,
+                customer_id INTEGER,
+                started_at TIMESTAMP NOT NULL,
+                ended_at TIMESTAMP NOT NULL,
+                turns INTEGER NOT NULL,
+                transcript BLOB NOT NULL
+                )
+            """
+        )
+        self.con.execute("CREATE INDEX IF NOT EXISTS idx_archive_customer ON conversation_archive(customer_id, ended_at)")
+        self.con.execute("CREATE INDEX IF NOT EXISTS idx_archive_ended ON conversation_archive(ended_at)")
+
+    def _create_customer_schema(self, con):
+        """Creates the customers table, its indexes, rollup, version triggers and event feed on one shard."""
+        query = """
+            CREATE TABLE IF NOT EXISTS customers(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name VARCHAR NOT NULL,
+                phone VARCHAR NOT NULL,
+                due_date DATE NOT NULL,
+                loan_amount REAL NOT NULL,
+                call_status VARCHAR DEFAULT 'Pending',
+                notes VARCHAR DEFAULT ''
+                )
+            """
+        con.execute(query)
+        self._add_missing_columns(con)
+        ## Inbound calls still resolve the caller by phone number
+        con.execute("CREATE INDEX IF NOT EXISTS idx_customers_phone ON customers(phone)")
+        ## Serves both status filters and the "next callable customers" range scans of claim_callable_customers
+        con.execute("CREATE INDEX IF NOT EXISTS idx_customers_schedule ON customers(call_status, next_attempt_at)")
+        con.execute("DROP INDEX IF EXISTS idx_customers_status")
+        self._create_rollup(con)
+        self._create_data_version(con)
+        self._create_search_index(con)
+        ## Change feed for /events, written in the same transaction as the customer change it reports.
+        ## Each shard numbers its own events; AUTOINCREMENT so ids are never reused after pruning
+        con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS events(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                type VARCHAR NOT NULL,
+                customer_id INTEGER,
+                payload TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """
+        )
+
+    def _create_rollup(self, con):
+        """
+        Creates `customer_rollup`, a per (call_status, due_date) count and loan total kept
+        current by triggers on `customers`. The dashboard summary aggregates this small
+        table instead of scanning every customer, so its cost doesn't grow with the portfolio.
+        """
+        con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS customer_rollup(
+                call_status VARCHAR,
+                due_date DATE,
+                customers INTEGER NOT NULL,
+                loan_amount REAL NOT NULL,
+                PRIMARY KEY (call_status, due_date)
+                ) WITHOUT ROWID
+            """
+        )
+        add_new = """
+            INSERT INTO customer_rollup (call_status, due_date, customers, loan_amount)
+            VALUES (NEW.call_status, NEW.due_date, 1, NEW.loan_amount)
+            ON CONFLICT (call_status, due_date) DO UPDATE SET
+                customers = customers + 1, loan_amount = loan_amount + excluded.loan_amount;
+        """
+        remove_old = """
+            UPDATE customer_rollup SET customers = customers - 1, loan_amount = loan_amount - OLD.loan_amount
+            WHERE call_status IS OLD.call_status AND due_date IS OLD.due_date;
+        """
+        con.execute(f"CREATE TRIGGER IF NOT EXISTS trg_rollup_insert AFTER INSERT ON customers BEGIN {add_new} END")
+        con.execute(f"CREATE TRIGGER IF NOT EXISTS trg_rollup_delete AFTER DELETE ON customers BEGIN {remove_old} END")
+        con.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_rollup_update AFTER UPDATE OF call_status, due_date, loan_amount ON customers
+            BEGIN {remove_old} {add_new} END
+            """
+        )
+        ## Databases created before the rollup existed are backfilled once
+        if (con.execute("SELECT 1 FROM customers LIMIT 1").fetchone()
+                and not con.execute("SELECT 1 FROM customer_rollup LIMIT 1").fetchone()):
+            self._rebuild_rollup(con)
+
+    def rebuild_rollup(self):
+        """Recomputes `customer_rollup` from the customers table of every shard."""
+        for index, con in enumerate(self.shards):
+            with self._transaction(index):
+                self._rebuild_rollup(con)
+
+    @staticmethod
+    def _rebuild_rollup(con):
+        """Recomputes one shard's rollup (inside the caller's transaction)."""
+        con.execute("DELETE FROM customer_rollup")
+        con.execute(
+            """
+            INSERT INTO customer_rollup (call_status, due_date, customers, loan_amount)
+            SELECT call_status, due_date, COUNT(*), TOTAL(loan_amount) FROM customers GROUP BY call_status, due_date
+            """
+        )
+        logger.info("Rebuilt customer rollup")
+
+    def _create_data_version(self, con):
+        """
+        Creates the single-row `data_version` counter, bumped by triggers on every write to
+        `customers` (from any process), so readers can tell cheaply whether lists changed.
+        """
+        con.execute(
+            "CREATE TABLE IF NOT EXISTS data_version(id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL)"
+        )
+        con.execute("INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0)")
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            con.execute(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS trg_data_version_{event.lower()} AFTER {event} ON customers
+                BEGIN UPDATE data_version SET version = version + 1 WHERE id = 1; END
+                """
+            )
+
+    def _create_search_index(self, con):
+        """
+        Creates `customer_search`, an FTS5 index over name, phone and notes that reads its
+        content from `customers` (nothing is stored twice) and is kept in step by triggers,
+        so every add_customer / log_call_outcome write is searchable immediately.
+        """
+        exists = con.execute("SELECT 1 FROM sqlite_master WHERE name = 'customer_search'").fetchone()
+        con.execute(
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS customer_search USING fts5(
+                name, phone, notes, content='customers', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+                )
+            """
+        )
+        ## An external-content index must be told the exact old values to remove them
+        add_new = f"""
+            INSERT INTO customer_search (rowid, name, phone, notes)
+            VALUES (NEW.id, NEW.name, {SEARCH_PHONE.format(row="NEW")}, NEW.notes);
+        """
+        remove_old = f"""
+            INSERT INTO customer_search (customer_search, rowid, name, phone, notes)
+            VALUES ('delete', OLD.id, OLD.name, {SEARCH_PHONE.format(row="OLD")}, OLD.notes);
+        """
+        con.execute(f"CREATE TRIGGER IF NOT EXISTS trg_search_insert AFTER INSERT ON customers BEGIN {add_new} END")
+        con.execute(f"CREATE TRIGGER IF NOT EXISTS trg_search_delete AFTER DELETE ON customers BEGIN {remove_old} END")
+        con.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_search_update AFTER UPDATE OF name, phone, notes ON customers
+            BEGIN {remove_old} {add_new} END
+            """
+        )
+        if not exists:
+            ## Index customers stored before search existed (same phone text as the triggers)
+            con.execute(
+                f"""
+                INSERT INTO customer_search (rowid, name, phone, notes)
+                SELECT id, name, {SEARCH_PHONE.format(row="customers")}, notes FROM customers
+                """
+            )
+
+    @timed("db_query_seconds", query="get_data_version")
+    def get_data_version(self) -> int:
+        """Returns the customers data version (changes after every insert, update or delete on any shard)."""
+        try:
+            ## Each shard's counter only grows, so their sum changes whenever any of them does
+            return sum(con.execute("SELECT version FROM data_version WHERE id = 1").fetchone()[0] for con in self.shards)
+        except Exception as e:
+            logger.error("Error reading data version: %s", e)
+            return -1
+
+    @staticmethod
+    def _add_missing_columns(con):
+        """Adds columns introduced after a database file was created (SQLite has no ADD COLUMN IF NOT EXISTS)."""
+        existing = {row[1] for row in con.execute("PRAGMA table_info(customers)")}
+        for column, definition, backfill in CUSTOMER_MIGRATIONS:
+            if column not in existing:
+                con.execute(f"ALTER TABLE customers ADD COLUMN {column} {definition}")
+                if backfill:
+                    con.execute(backfill)
+                logger.info("Added column customers.%s", column)
+
+    def _insert_customers(self, customers: list[tuple], record_events: bool = False) -> list[int]:
+        """
+        Inserts (name, phone, due_date, loan_amount, call_status, notes) rows and returns their ids.
+
+        With a single shard SQLite assigns the ids. With several, each row goes to the shard
+        of its phone bucket and gets the next id in that bucket (id % NUM_BUCKETS == bucket);
+        reading the high-water mark and inserting happen in one write transaction, so
+        concurrent writers (threads or processes) can't pick the same id.
+
+        With `record_events` a customer_added event is written alongside each row.
+        """
+        ## First call attempt is scheduled LEAD_DAYS before the due date
+        query = f"""
+            INSERT INTO customers (id, name, phone, due_date, loan_amount, call_status, notes, next_attempt_at)
+            VALUES (?1, ?2, ?3, ?4, ?5, ?6, ?7, COALESCE(datetime(?4, '-{call_schedule.LEAD_DAYS} days'), '1970-01-01 00:00:00'))
+            """
+        if not self.sharded:
+            with self._transaction(0) as con:
+                ids = []
+                for customer in customers:
+                    ids.append(con.execute(query, (None, *customer)).lastrowid)
+                    if record_events:
+                        self._append_event(con, "customer_added", ids[-1], self._added_payload(customer))
+                return ids
+
+        by_shard = {}
+        for customer in customers:
+            bucket = phone_bucket(customer[1])
+            by_shard.setdefault(self.bucket_shard[bucket], []).append((bucket, customer))
+        ids = []
+        for index, rows in by_shard.items():
+            with self._transaction(index) as con:
+                ## AUTOINCREMENT's high-water mark also covers deleted rows, so ids are never reused
+                seq = con.execute("SELECT seq FROM sqlite_sequence WHERE name = 'customers'").fetchone()
+                max_id = max(con.execute("SELECT COALESCE(MAX(id), 0) FROM customers").fetchone()[0], seq[0] if seq else 0)
+                for bucket, customer in rows:
+                    new_id = max_id - max_id % NUM_BUCKETS + bucket
+                    if new_id <= max_id:
+                        new_id += NUM_BUCKETS
+                    con.execute(query, (new_id, *customer))
+                    if record_events:
+                        self._append_event(con, "customer_added", new_id, self._added_payload(customer))
+                    ids.append(new_id)
+                    max_id = new_id
+        return ids
+
+    @staticmethod
+    def _added_payload(customer: tuple) -> dict:
+        name, phone, due_date, loan_amount, call_status, _ = customer
+        return {"name": name, "phone": phone, "due_date": due_date, "loan_amount": loan_amount, "call_status": call_status}
+
     def seed_simple_data(self):
         """Add simple sample data without external dependencies"""
         try:
@@ -52,13 +555,9 @@ class Database:
                 ("Tom Brown", "+1234567894", "2024-02-05", 4600.0, "Pending", ""),
             ]
 
-            self.con.executemany(
-                "INSERT INTO customers (name, phone, due_date, loan_amount, call_status, notes) VALUES (?, ?, ?, ?, ?, ?)",
-                customers
-            )
-            self.con.commit()
+            self._insert_customers(customers)
         except Exception as e:
-            print(f"Error seeding data: {e}")
+            logger.error("Error seeding data: %s", e)
             # Don't raise here, app can work without sample data
 
     def seed_data(self, n=5):
@@ -67,7 +566,7 @@ class Database:
             from faker import Faker
             fake = Faker()
             customers = []
-            
+
             for _ in range(n):
                 name = fake.name()
                 phone = fake.phone_number()
@@ -75,19 +574,16 @@ class Database:
                 loan_amount = round(random.uniform(500, 20000), 2)
                 customers.append((name, phone, due_date, loan_amount, "Pending", ""))
 
-            self.con.executemany(
-                "INSERT INTO customers (name, phone, due_date, loan_amount, call_status, notes) VALUES (?, ?, ?, ?, ?, ?)",
-                customers
-            )
-            self.con.commit()
-            
+            self._insert_customers(customers)
+
         except ImportError:
-            print("Faker not available, using simple seed data")
+            logger.warning("Faker not available, using simple seed data")
             self.seed_simple_data()
         except Exception as e:
-            print(f"Error in seed_data: {e}")
+            logger.error("Error in seed_data: %s", e)
             self.seed_simple_data()
 
+    @timed("db_query_seconds", query="add_customer")
     def add_customer(self, name: str, phone: str, due_date: str, loan_amount: float) -> int | None:
         """
         Adds a new customer record to the database.
@@ -102,115 +598,835 @@ class Database:
             int | None: The ID of the newly inserted customer, or None if insertion fails.
         """
         try:
-            cur = self.con.execute(
-                """
-                INSERT INTO customers (name, phone, due_date, loan_amount, call_status, notes)
-                VALUES (?, ?, ?, ?, 'Pending', '')
-                """,
-                (name, phone, due_date, loan_amount)
-            )
-            self.con.commit()
-            new_customer_id = cur.lastrowid
-            print(f"✓ Added customer: {name}, {phone}")
-            self.con.rollback()
+            new_customer_id = self._insert_customers([(name, phone, due_date, loan_amount, "Pending", "")], record_events=True)[0]
+            logger.info("Added customer: %s, %s", name, phone)
             return new_customer_id
         except Exception as e:
-            print(f"Error adding customer {name}: {e}")
+            logger.error("Error adding customer %s: %s", name, e)
             return None
 
-    def fetch_all_customers(self) -> list[dict]: 
-        """ Returns info of all the customers in the database."""
+    @timed("db_query_seconds", query="list_customers")
+    def list_customers(self, status: str | None = None, include_notes: bool = False) -> list[Customer_record]:
+        """
+        Lists customers (optionally only those with `status`) in id order, reading only
+        the columns the list needs.
+
+        Args:
+            status (str, optional): Only return customers with this call_status.
+            include_notes (bool): Also read the transcript (returns Customer_detail records).
+
+        Returns:
+            list[Customer_record]: Slotted records, ready for orjson.
+        """
+        record_type, columns = (Customer_detail, DETAIL_COLUMNS) if include_notes else (Customer_record, LIST_COLUMNS)
+        query = f"SELECT {columns} FROM customers"
+        params = ()
+        if status is not None:
+            query += " WHERE call_status = ?"
+            params = (status,)
+        query += " ORDER BY id"
+
+        def fetch(con):
+            cur = con.cursor()
+            cur.row_factory = lambda _, row: record_type(*row)
+            return cur.execute(query, params).fetchall()
+
         try:
-            cur = self.con.execute("SELECT * FROM customers")
-            rows = cur.fetchall()
-        
-            # Get the column names from the cursor's description
-            keys = [description[0] for description in cur.description]
-            
-            # Create a list of dictionaries by zipping the keys with each row's values
-            return [dict(zip(keys, row)) for row in rows]
-        except Exception as e:
-            print(f"Some unknown Error {e}")
+            if not self.sharded:
+                return fetch(self.con)
+            return list(heapq.merge(*(fetch(con) for con in self.shards), key=attrgetter("id")))
+        except Exception as e:
+            logger.error("Error listing customers: %s", e)
+            return []
+
+    @timed("db_query_seconds", query="search_customers")
+    def search_customers(self, text: str, limit: int = 20, offset: int = 0) -> list[Customer_match]:
+        """
+        Full-text search over customer names, phone numbers and call notes, best match first.
+
+        Every word of `text` must match the start of a word in one of the columns. Each
+        shard answers from its own index and only the first `offset + limit` hits of each
+        are merged, so the cost depends on the page, not on the portfolio size.
+
+        Args:
+            text (str): What the user typed.
+            limit (int): Page size.
+            offset (int): Number of hits to skip.
+
+        Returns:
+            list[Customer_match]: Up to `limit` matches.
+        """
+        expression = search_expression(text)
+        if expression is None:
             return []
+        query = f"""
+            SELECT {", ".join(f"c.{field.name}" for field in fields(Customer_record))},
+                   snippet(customer_search, 2, '[', ']', '…', 12),
+                   bm25(customer_search, {SEARCH_WEIGHTS}) AS score
+            FROM customer_search JOIN customers c ON c.id = customer_search.rowid
+            WHERE customer_search MATCH ?
+            ORDER BY score, c.id
+            LIMIT ?
+            """
+
+        def fetch(con):
+            cur = con.cursor()
+            cur.row_factory = lambda _, row: Customer_match(*row)
+            return cur.execute(query, (expression, offset + limit)).fetchall()
 
-    def fetch_due_customers(self):
-        """Return info of all customers whose status is pending"""
         try:
-            cur = self.con.execute("SELECT * FROM customers WHERE call_status = 'Pending' ")
-            rows = cur.fetchall()
-            keys = [description[0] for description in cur.description]
-            return [dict(zip(keys, row)) for row in rows]
+            ## Scores come from per-shard statistics, close enough to interleave the shards' pages
+            hits = heapq.merge(*(fetch(con) for con in self.shards), key=attrgetter("score", "id"))
+            return list(itertools.islice(hits, offset, offset + limit))
         except Exception as e:
-            print(f"Error fetching due customers: {e}")
+            logger.error("Error searching customers for %r: %s", text, e)
             return []
 
+    @timed("db_query_seconds", query="fetch_customer_by_id")
     def fetch_customer_by_id(self, customer_id) -> dict | None:
         """To fetch a cusotmer from thier ID."""
         try:
-            cur = self.con.execute("SELECT * FROM customers where id = ?", (customer_id,))
-            row = cur.fetchone()
-            if row:
-                # Convert tuple to a dictionary
-                keys = [description[0] for description in cur.description]
-                return dict(zip(keys, row))
-            return None
+            rows = self._fetch_dicts(self._shard_for_id(customer_id), "SELECT * FROM customers where id = ?", (customer_id,))
+            return rows[0] if rows else None
         except Exception as e:
-            print(f"Error fetching customer {customer_id}: {e}")
+            logger.error("Error fetching customer %s: %s", customer_id, e)
             return None
-        
+
+    @timed("db_query_seconds", query="get_customer_by_phone")
     def get_customer_by_phone(self, phone_number: str) -> dict | None:
         """
         Fetches a single customer by their phone number and returns a dictionary.
+        The phone's own shard is searched first; customers created before sharding
+        (or whose number changed) may live elsewhere, so the other shards follow.
+        """
+
+        try:
+            for con in self._shards_for_phone(phone_number):
+                rows = self._fetch_dicts(con, "SELECT * FROM customers WHERE phone = ? LIMIT 1", (phone_number,))
+                if rows:
+                    return rows[0]
+            return None
+        except Exception as e:
+            logger.error("Error fetching customer by phone %s: %s", phone_number, e)
+            return None
+
+    @timed("db_query_seconds", query="fetch_summary")
+    def fetch_summary(self, today: str | None = None) -> dict:
+        """
+        Dashboard aggregates, computed in SQL from the trigger-maintained `customer_rollup`
+        of every shard and added up.
+
+        Args:
+            today (str, optional): Reference date 'YYYY-MM-DD' for the due-date buckets (defaults to today).
+
+        Returns:
+            dict: {
+                "by_status": {call_status: {"count", "loan_amount"}},
+                "due": {"overdue" | "due_7_days" | "due_later": {"count", "loan_amount"}},
+                "total": {"count", "loan_amount"}
+            }
+            Due-date buckets only count customers whose call was not SUCCESSFUL (money still outstanding).
+        """
+        today_date = datetime.strptime(today, "%Y-%m-%d") if today else datetime.today()
+        week_end = (today_date + timedelta(days=7)).strftime("%Y-%m-%d")
+        today = today_date.strftime("%Y-%m-%d")
+        summary = {
+            "by_status": {},
+            "due": {bucket: {"count": 0, "loan_amount": 0.0} for bucket in ("overdue", "due_7_days", "due_later")},
+            "total": {"count": 0, "loan_amount": 0.0},
+        }
+
+        def add(entry, count, amount):
+            entry["count"] += count
+            entry["loan_amount"] += amount
+
+        try:
+            for con in self.shards:
+                for status, count, amount in con.execute(
+                    "SELECT call_status, SUM(customers), TOTAL(loan_amount) FROM customer_rollup GROUP BY call_status HAVING SUM(customers) > 0"
+                ):
+                    add(summary["by_status"].setdefault(status, {"count": 0, "loan_amount": 0.0}), count, amount)
+                    add(summary["total"], count, amount)
+
+                for bucket, count, amount in con.execute(
+                    """
+                    SELECT CASE WHEN due_date < ? THEN 'overdue' WHEN due_date <= ? THEN 'due_7_days' ELSE 'due_later' END,
+                           SUM(customers), TOTAL(loan_amount)
+                    FROM customer_rollup
+                    WHERE call_status != 'SUCCESSFUL' AND customers > 0
+                    GROUP BY 1
+                    """,
+                    (today, week_end)
+                ):
+                    add(summary["due"][bucket], count, amount)
+        except Exception as e:
+            logger.error("Error computing summary: %s", e)
+
+        for entry in [summary["total"], *summary["by_status"].values(), *summary["due"].values()]:
+            entry["loan_amount"] = round(entry["loan_amount"], 2)
+        return summary
+
+    def iter_transcripts(self, after_id: int = 0, page_size: int = 1000):
+        """
+        Yields (id, notes) for every customer with a stored transcript, in id order across all shards.
+        SMS_SENT rows are skipped: their notes hold the SMS text we sent, not what the caller said.
+
+        Rows are read one page at a time with keyset pagination (id > last seen id), so
+        memory stays flat and no cursor is held open while the caller writes to the database.
+
+        Args:
+            after_id (int): Only rows with a larger id are returned (resume point).
+            page_size (int): Rows fetched per query.
+        """
+        def pages(con):
+            last_id = after_id
+            while True:
+                rows = con.execute(
+                    "SELECT id, notes FROM customers WHERE id > ? AND notes != '' AND call_status != 'SMS_SENT' ORDER BY id LIMIT ?",
+                    (last_id, page_size)
+                ).fetchall()
+                if not rows:
+                    return
+                yield from rows
+                last_id = rows[-1][0]
+
+        yield from heapq.merge(*(pages(con) for con in self.shards))
+
+    @timed("db_query_seconds", query="bulk_update_outcomes")
+    def bulk_update_outcomes(self, outcomes: list[tuple]) -> int:
+        """
+        Writes many (customer_id, intent, status) results with one transaction per shard.
+
+        Rows are scheduled the way `log_call_outcome` schedules them: the claim is cleared
+        and next_attempt_at follows call_schedule.next_attempt_after for the new status.
+        A customer whose claim is still live (a dialer is on the call right now) only gets
+        the new intent and status; the dialer's own outcome reschedules it.
+
+        Returns:
+            int: Number of rows written (shards whose transaction was rolled back don't count).
+        """
+        by_shard = {}
+        for outcome in outcomes:
+            by_shard.setdefault(self._shard_index_for_id(outcome[0]), []).append(outcome)
+        now_db = call_schedule.to_db(call_schedule.utc_now())
+        written = 0
+        for index, shard_outcomes in by_shard.items():
+            try:
+                with self._transaction(index) as con:
+                    scheduled, claimed = [], []
+                    for customer_id, intent, status in shard_outcomes:
+                        row = con.execute(
+                            "SELECT attempts, locked_by IS NOT NULL AND next_attempt_at > ? FROM customers WHERE id = ?",
+                            (now_db, customer_id)
+                        ).fetchone()
+                        if row and row[1]:
+                            claimed.append((intent, status, customer_id))
+                            continue
+                        next_attempt = call_schedule.next_attempt_after(status, row[0] if row else 0)
+                        scheduled.append((intent, status, call_schedule.to_db(next_attempt) if next_attempt else None, customer_id))
+                    con.executemany(
+                        """
+                        UPDATE customers SET intent = ?, call_status = ?,
+                            locked_by = NULL, locked_at = NULL, next_attempt_at = ?
+                        WHERE id = ?
+                        """,
+                        scheduled
+                    )
+                    con.executemany("UPDATE customers SET intent = ?, call_status = ? WHERE id = ?", claimed)
+                    ## One event per shard batch: per-row events from a portfolio re-score would flood every subscriber
+                    self._append_event(con, "outcomes_updated", None, {"count": len(shard_outcomes)})
+                written += len(shard_outcomes)
+            except Exception as e:
+                logger.error("Error writing %d outcomes to shard %d: %s", len(shard_outcomes), index, e)
+        return written
+
+    @timed("db_query_seconds", query="log_call_outcome")
+    def log_call_outcome(self, customer_id, status, notes, intent=None):
+        """
+        Update the status and notes (and the classified intent, if known) for a particular customer.
+        Also releases the customer's dialing claim and schedules the next attempt for outcomes
+        that need one (NEEDS FOLLOW-UP, UNCLEAR) with exponential backoff inside calling hours.
+        """
+        try:
+            with self._transaction(self._shard_index_for_id(customer_id)) as con:
+                row = con.execute("SELECT attempts FROM customers WHERE id = ?", (customer_id,)).fetchone()
+                next_attempt = call_schedule.next_attempt_after(status, row[0] if row else 0)
+                con.execute(
+                    """
+                    UPDATE customers SET call_status = ?, notes = ?, intent = COALESCE(?, intent),
+                        locked_by = NULL, locked_at = NULL, next_attempt_at = ?
+                    WHERE id = ?
+                    """,
+                    (status, notes, intent, call_schedule.to_db(next_attempt) if next_attempt else None, customer_id)
+                )
+                self._append_event(con, "status_changed", customer_id, {"call_status": status, "intent": intent})
+            logger.info("Updated customer %s: %s", customer_id, status)
+        except Exception as e:
+            logger.error("Error updating customer %s: %s", customer_id, e)
+
+    @timed("db_query_seconds", query="claim_callable_customers")
+    def claim_callable_customers(self, worker_id: str, limit: int = 1) -> list[dict]:
+        """
+        Atomically reserves up to `limit` customers that are due for a call.
+
+        A customer is callable when their status is in CALLABLE_STATUSES and
+        next_attempt_at has passed. Claiming sets locked_by/locked_at, counts the attempt
+        and moves next_attempt_at to the end of the lease, so the row drops out of every
+        other dialer's range scan; if the dialer never reports back, the customer becomes
+        callable again once the lease runs out. Each status is one range scan on
+        idx_customers_schedule, so a claim costs O(log n + limit).
+
+        Args:
+            worker_id (str): Identifies the dialer (process, host or operator).
+            limit (int): Maximum number of customers to claim.
+
+        Returns:
+            list[dict]: The claimed customers, earliest scheduled first (empty outside calling hours).
         """
+        if limit <= 0 or not call_schedule.within_calling_hours():
+            return []
+        now = call_schedule.utc_now()
+        now_db, lease_until = call_schedule.to_db(now), call_schedule.to_db(now + call_schedule.CLAIM_LEASE)
+        per_status = " UNION ALL ".join(
+            "SELECT * FROM (SELECT id, next_attempt_at FROM customers WHERE call_status = ? AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?)"
+            for _ in call_schedule.CALLABLE_STATUSES
+        )
+        query = f"SELECT id FROM ({per_status}) ORDER BY next_attempt_at LIMIT ?"
 
+        claimed = []
+        ## Start at a random shard so concurrent dialers don't all contend for the same file
+        start = random.randrange(len(self.shards))
+        for index in [(start + i) % len(self.shards) for i in range(len(self.shards))]:
+            wanted = limit - len(claimed)
+            if wanted <= 0:
+                break
+            params = [value for status in call_schedule.CALLABLE_STATUSES for value in (status, now_db, wanted)] + [wanted]
+            try:
+                ## Select and mark in one write transaction: no other dialer can see the rows in between
+                with self._transaction(index) as con:
+                    ids = [row[0] for row in con.execute(query, params)]
+                    if ids:
+                        marks = ", ".join("?" * len(ids))
+                        con.execute(
+                            f"""
+                            UPDATE customers SET locked_by = ?, locked_at = ?, next_attempt_at = ?, attempts = attempts + 1
+                            WHERE id IN ({marks})
+                            """,
+                            (worker_id, now_db, lease_until, *ids)
+                        )
+                        claimed.extend(self._fetch_dicts(con, f"SELECT * FROM customers WHERE id IN ({marks})", ids))
+            except Exception as e:
+                logger.error("Error claiming customers on shard %d: %s", index, e)
+        if claimed:
+            logger.info("Worker %s claimed %d customer(s)", worker_id, len(claimed))
+        return claimed
+
+    @timed("db_query_seconds", query="claim_customer")
+    def claim_customer(self, customer_id, worker_id: str) -> bool:
+        """
+        Reserves one specific customer (an operator pressing "call"), unless another
+        dialer holds an unexpired claim on them.
+
+        A dialer starting a call for a customer it already claimed (via
+        claim_callable_customers) succeeds: its lease is renewed without counting a
+        second attempt.
+
+        Returns:
+            bool: True if the claim was taken.
+        """
+        now = call_schedule.utc_now()
+        now_db = call_schedule.to_db(now)
         try:
-            cur = self.con.execute("SELECT * FROM customers WHERE phone = ?", (phone_number,))
-            row = cur.fetchone()
+            with self._transaction(self._shard_index_for_id(customer_id)) as con:
+                cur = con.execute(
+                    """
+                    UPDATE customers SET locked_by = ?1, locked_at = ?2, next_attempt_at = ?3,
+                        attempts = attempts + (CASE WHEN locked_by = ?1 AND next_attempt_at > ?2 THEN 0 ELSE 1 END)
+                    WHERE id = ?4 AND (locked_by IS NULL OR locked_by = ?1 OR next_attempt_at <= ?2)
+                    """,
+                    (worker_id, now_db, call_schedule.to_db(now + call_schedule.CLAIM_LEASE), customer_id)
+                )
+            return cur.rowcount == 1
+        except Exception as e:
+            logger.error("Error claiming customer %s: %s", customer_id, e)
+            return False
+
+    @timed("db_query_seconds", query="release_claim")
+    def release_claim(self, customer_id, retry_now: bool = False):
+        """
+        Releases a claim that ended without a recorded outcome (the call failed to start,
+        or ended before log_call_outcome ran). The customer is rescheduled like an UNCLEAR
+        outcome, or made callable immediately with `retry_now`. No-op if no claim is held.
+        """
+        try:
+            with self._transaction(self._shard_index_for_id(customer_id)) as con:
+                row = con.execute("SELECT attempts FROM customers WHERE id = ? AND locked_by IS NOT NULL", (customer_id,)).fetchone()
+                if not row:
+                    return
+                next_attempt = call_schedule.utc_now() if retry_now else call_schedule.next_attempt_after("UNCLEAR", row[0])
+                con.execute(
+                    "UPDATE customers SET locked_by = NULL, locked_at = NULL, next_attempt_at = ? WHERE id = ?",
+                    (call_schedule.to_db(next_attempt) if next_attempt else None, customer_id)
+                )
+        except Exception as e:
+            logger.error("Error releasing claim on customer %s: %s", customer_id, e)
+
+    def rebalance(self, shard_count: int) -> dict:
+        """
+        Spreads the virtual buckets over `shard_count` shard files (bucket b -> shard b % shard_count)
+        and moves the affected customers. Each bucket is copied to its new shard, then the map is
+        switched, then the old copy is deleted, so an interrupted run can simply be repeated.
+
+        Dialers and the API should be stopped while this runs and restarted afterwards,
+        since every process caches the bucket map when it opens the database.
+
+        Returns:
+            dict: {"shards": shard_count, "buckets_moved": int, "customers_moved": int}
+        """
+        if shard_count < 1:
+            raise ValueError("shard_count must be at least 1")
+        while len(self.shards) < shard_count:
+            self._open_shard(len(self.shards))
+
+        buckets_moved = customers_moved = 0
+        for bucket in range(NUM_BUCKETS):
+            source_index, target_index = self.bucket_shard[bucket], bucket % shard_count
+            if source_index == target_index:
+                continue
+            source, target = self.shards[source_index], self.shards[target_index]
+            cur = source.execute("SELECT * FROM customers WHERE id % ? = ?", (NUM_BUCKETS, bucket))
+            rows = cur.fetchall()
+            columns = [description[0] for description in cur.description]
+            with self._transaction(target_index):
+                ## Leftovers from an interrupted run are replaced, not duplicated
+                target.execute("DELETE FROM customers WHERE id % ? = ?", (NUM_BUCKETS, bucket))
+                target.executemany(
+                    f"INSERT INTO customers ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", rows
+                )
+            with self._transaction(0):
+                self.con.execute("UPDATE shard_map SET shard = ? WHERE bucket = ?", (target_index, bucket))
+            self.bucket_shard[bucket] = target_index
+            with self._transaction(source_index):
+                source.execute("DELETE FROM customers WHERE id % ? = ?", (NUM_BUCKETS, bucket))
+            buckets_moved += 1
+            customers_moved += len(rows)
+            logger.info("Moved bucket %d (%d customers) from shard %d to shard %d", bucket, len(rows), source_index, target_index)
+
+        return {"shards": shard_count, "buckets_moved": buckets_moved, "customers_moved": customers_moved}
+
+    @timed("db_query_seconds", query="record_event")
+    def record_event(self, event_type: str, customer_id=None, payload: dict | None = None) -> int | None:
+        """
+        Appends an event to the change feed served by /events, on the shard that owns
+        `customer_id` (shard 0 for events without a customer). Customer writes record their
+        events inside their own transaction instead; this is for events with no row change.
+
+        Args:
+            event_type (str): e.g. "customer_added", "status_changed", "sms_sent", "call_ended".
+            customer_id (int, optional): Customer the event is about.
+            payload (dict, optional): JSON-serialisable details.
+
+        Returns:
+            int | None: The event id, or None if it couldn't be stored.
+        """
+        try:
+            index = 0 if customer_id is None else self._shard_index_for_id(customer_id)
+            with self._transaction(index) as con:
+                return self._append_event(con, event_type, customer_id, payload)
+        except Exception as e:
+            logger.error("Error recording %s event: %s", event_type, e)
+            return None
+
+    @staticmethod
+    def _append_event(con, event_type: str, customer_id=None, payload: dict | None = None) -> int:
+        """Inserts an event row inside the caller's transaction on `con`."""
+        return con.execute(
+            "INSERT INTO events (type, customer_id, payload) VALUES (?, ?, ?)",
+            (event_type, customer_id, json.dumps(payload or {}))
+        ).lastrowid
+
+    @timed("db_query_seconds", query="fetch_events_after")
+    def fetch_events_after(self, cursor: list[int], limit: int = 500, until: list[int] | None = None) -> list[dict]:
+        """
+        Returns up to `limit` events after `cursor`, oldest first ('payload' still JSON text).
+
+        Each shard numbers its events separately, so the position in the feed is one last-seen
+        id per shard (missing trailing entries count as 0). Every event carries the index of
+        the shard it came from; shards are merged by creation time.
+
+        Args:
+            cursor (list[int]): Last id already seen on each shard.
+            limit (int): Maximum number of events returned.
+            until (list[int], optional): Per-shard upper bound (inclusive) on the ids returned.
+        """
+        try:
+            per_shard = []
+            for index, con in enumerate(self.shards):
+                after = cursor[index] if index < len(cursor) else 0
+                upto = -1 if until is None else until[index] if index < len(until) else 0
+                events = self._fetch_dicts(
+                    con,
+                    """
+                    SELECT id, type, customer_id, payload, created_at FROM events
+                    WHERE id > ? AND (? < 0 OR id <= ?) ORDER BY id LIMIT ?
+                    """,
+                    (after, upto, upto, limit)
+                )
+                for event in events:
+                    event["shard"] = index
+                per_shard.append(events)
+            if len(per_shard) == 1:
+                return per_shard[0]
+            return list(itertools.islice(heapq.merge(*per_shard, key=itemgetter("created_at")), limit))
+        except Exception as e:
+            logger.error("Error fetching events after %s: %s", cursor, e)
+            return []
+
+    def event_id_range(self) -> tuple[list[int], list[int]]:
+        """(oldest, newest) retained event id of every shard; 0 for a shard without events."""
+        oldest, newest = [], []
+        for con in self.shards:
+            row = con.execute("SELECT COALESCE(MIN(id), 0), COALESCE(MAX(id), 0) FROM events").fetchone()
+            oldest.append(row[0])
+            newest.append(row[1])
+        return oldest, newest
+
+    @timed("db_query_seconds", query="prune_events")
+    def prune_events(self, older_than_seconds: float) -> int:
+        """Deletes events older than the retention window from every shard. Returns the number removed."""
+        removed = 0
+        for index in range(len(self.shards)):
+            try:
+                with self._transaction(index) as con:
+                    ## Ids grow with time, so find the first event to keep and delete everything before it
+                    cur = con.execute(
+                        """
+                        DELETE FROM events WHERE id < COALESCE(
+                            (SELECT id FROM events WHERE created_at >= datetime('now', ?) ORDER BY id LIMIT 1),
+                            (SELECT MAX(id) + 1 FROM events))
+                        """,
+                        (f"-{int(older_than_seconds)} seconds",)
+                    )
+                removed += cur.rowcount
+            except Exception as e:
+                logger.error("Error pruning events on shard %d: %s", index, e)
+        return removed
+
+    @timed("db_query_seconds", query="save_call_binding")
+    def save_call_binding(self, call_id: str, customer: dict) -> bool:
+        """
+        Records which customer a Vapi call belongs to, together with a snapshot of the
+        fields the dialogue needs, so every webhook turn can be resolved by call id.
+        Bindings older than CALL_BINDING_TTL_SECONDS (calls whose call-end never arrived)
+        are pruned in the same transaction.
+
+        Args:
+            call_id (str): The Vapi call id returned when the call was started.
+            customer (dict): The customer row (needs 'id'; name, phone, due_date and loan_amount are snapshotted).
+
+        Returns:
+            bool: True if the binding was stored.
+        """
+        try:
+            with self._transaction(0):
+                self.con.execute(
+                    """
+                    INSERT OR REPLACE INTO call_bindings (call_id, customer_id, name, phone, due_date, loan_amount)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    (call_id, customer["id"], customer.get("name"), customer.get("phone"),
+                     customer.get("due_date"), customer.get("loan_amount"))
+                )
+                self.con.execute(
+                    "DELETE FROM call_bindings WHERE created_at < datetime('now', ?)",
+                    (f"-{CALL_BINDING_TTL_SECONDS} seconds",)
+                )
+            return True
+        except Exception as e:
+            logger.error("Error binding call %s to customer %s: %s", call_id, customer.get("id"), e)
+            return False
+
+    @timed("db_query_seconds", query="get_call_binding")
+    def get_call_binding(self, call_id: str) -> dict | None:
+        """
+        Returns the customer snapshot bound to a call as a customer-shaped dict
+        ('id', 'name', 'phone', 'due_date', 'loan_amount'), or None for unknown (e.g. inbound) calls.
+        """
+        try:
+            row = self.con.execute(
+                "SELECT customer_id, name, phone, due_date, loan_amount FROM call_bindings WHERE call_id = ?",
+                (call_id,)
+            ).fetchone()
             if row:
-                keys = [description[0] for description in cur.description]
-                return dict(zip(keys, row))
+                return dict(zip(("id", "name", "phone", "due_date", "loan_amount"), row))
             return None
         except Exception as e:
-            print(f"Error fetching customer by phone {phone_number}: {e}")
+            logger.error("Error fetching binding for call %s: %s", call_id, e)
             return None
 
-    def log_call_outcome(self, customer_id, status, notes):
-        """Update the status and notes for a particular customer"""
+    @timed("db_query_seconds", query="delete_call_binding")
+    def delete_call_binding(self, call_id: str):
+        """Removes a call binding once the call has ended."""
         try:
+            with self._transaction(0):
+                self.con.execute("DELETE FROM call_bindings WHERE call_id = ?", (call_id,))
+        except Exception as e:
+            logger.error("Error deleting binding for call %s: %s", call_id, e)
+
+    @timed("db_query_seconds", query="claim_delivery")
+    def claim_delivery(self, key: str, now: float, expired_before: float) -> bool:
+        """
+        Takes a webhook delivery for processing, unless some worker already has it.
+
+        A row older than `expired_before` (a finished delivery past its TTL, or an attempt
+        whose worker died) is taken over.
+
+        Returns:
+            bool: True if this caller owns the delivery and must process it.
+        """
+        with self._transaction(0):
+            cur = self.con.execute(
+                """
+                INSERT INTO webhook_deliveries (key, response, created_at) VALUES (?, NULL, ?)
+                ON CONFLICT (key) DO UPDATE SET response = NULL, created_at = excluded.created_at
+                WHERE created_at < ?
+                """,
+                (key, now, expired_before)
+            )
+        return cur.rowcount == 1
+
+    def get_delivery(self, key: str) -> tuple[bool, str | None]:
+        """(claimed, stored JSON response) for a delivery; the response is None while it is still processing."""
+        row = self.con.execute("SELECT response FROM webhook_deliveries WHERE key = ?", (key,)).fetchone()
+        return (False, None) if row is None else (True, row[0])
+
+    def finish_delivery(self, key: str, response: str):
+        """Stores the JSON response of a processed delivery for its retries."""
+        with self._transaction(0):
+            self.con.execute("UPDATE webhook_deliveries SET response = ? WHERE key = ?", (response, key))
+
+    def forget_delivery(self, key: str):
+        """Releases a delivery whose processing failed, so the next retry runs it again."""
+        with self._transaction(0):
+            self.con.execute("DELETE FROM webhook_deliveries WHERE key = ?", (key,))
+
+    @timed("db_query_seconds", query="prune_deliveries")
+    def prune_deliveries(self, older_than: float) -> int:
+        """Deletes deliveries created before `older_than` (epoch seconds). Returns the number removed."""
+        try:
+            with self._transaction(0):
+                cur = self.con.execute("DELETE FROM webhook_deliveries WHERE created_at < ?", (older_than,))
+            return cur.rowcount
+        except Exception as e:
+            logger.error("Error pruning webhook deliveries: %s", e)
+            return 0
+
+    @timed("db_query_seconds", query="add_turn_fragment")
+    def add_turn_fragment(self, call_id: str, text: str) -> int:
+        """Stores a user transcript fragment as the call's newest generation and returns that generation."""
+        with self._transaction(0):
+            generation = self.con.execute(
+                """
+                INSERT INTO call_turns (call_id, generation, updated_at) VALUES (?, 1, ?)
+                ON CONFLICT (call_id) DO UPDATE SET generation = generation + 1, updated_at = excluded.updated_at
+                RETURNING generation
+                """,
+                (call_id, time.time())
+            ).fetchone()[0]
             self.con.execute(
-                "UPDATE customers SET call_status = ?, notes = ? WHERE id = ?",
-                (status, notes, customer_id)
+                "INSERT INTO turn_fragments (call_id, generation, text) VALUES (?, ?, ?)",
+                (call_id, generation, text)
+            )
+        return generation
+
+    def turn_generation(self, call_id: str) -> int | None:
+        """The call's newest transcript generation, or None once the call has ended."""
+        row = self.con.execute("SELECT generation FROM call_turns WHERE call_id = ?", (call_id,)).fetchone()
+        return row[0] if row else None
+
+    def pending_fragments(self, call_id: str, generation: int) -> list[str]:
+        """Unanswered fragments of a call up to `generation`, oldest first."""
+        return [row[0] for row in self.con.execute(
+            "SELECT text FROM turn_fragments WHERE call_id = ? AND generation <= ? ORDER BY generation",
+            (call_id, generation)
+        )]
+
+    def complete_turn(self, call_id: str, generation: int):
+        """Drops the fragments answered by a turn, so they aren't merged into the next one."""
+        with self._transaction(0):
+            self.con.execute("DELETE FROM turn_fragments WHERE call_id = ? AND generation <= ?", (call_id, generation))
+
+    def end_call_turns(self, call_id: str):
+        """Forgets a call's turn state (its generation then reads as None)."""
+        with self._transaction(0):
+            self.con.execute("DELETE FROM turn_fragments WHERE call_id = ?", (call_id,))
+            self.con.execute("DELETE FROM call_turns WHERE call_id = ?", (call_id,))
+
+    @timed("db_query_seconds", query="prune_call_turns")
+    def prune_call_turns(self, older_than: float) -> int:
+        """Deletes the turn state of calls idle since before `older_than` (epoch seconds; calls that never sent call-end)."""
+        try:
+            with self._transaction(0):
+                self.con.execute(
+                    "DELETE FROM turn_fragments WHERE call_id IN (SELECT call_id FROM call_turns WHERE updated_at < ?)",
+                    (older_than,)
+                )
+                cur = self.con.execute("DELETE FROM call_turns WHERE updated_at < ?", (older_than,))
+            return cur.rowcount
+        except Exception as e:
+            logger.error("Error pruning call turn state: %s", e)
+            return 0
+
+    @timed("db_query_seconds", query="append_call_turns")
+    def append_call_turns(self, call_id: str, customer_id, turns: list) -> bool:
+        """
+        Appends turns (conversation_archive.Turn_record) to a live call's dialogue.
+
+        Returns:
+            bool: True if the turns are stored.
+        """
+        try:
+            with self._transaction(0):
+                seq = self.con.execute(
+                    "SELECT COALESCE(MAX(seq), 0) FROM conversation_turns WHERE call_id = ?", (call_id,)
+                ).fetchone()[0]
+                self.con.executemany(
+                    """
+                    INSERT INTO conversation_turns (call_id, seq, customer_id, role, text, intent, sentiment, ts)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    [(call_id, seq + offset, customer_id, turn.role, turn.text, turn.intent, turn.sentiment, turn.ts)
+                     for offset, turn in enumerate(turns, 1)]
+                )
+            return True
+        except Exception as e:
+            logger.error("Error storing turns for call %s: %s", call_id, e)
+            return False
+
+    @timed("db_query_seconds", query="fetch_call_turns")
+    def fetch_call_turns(self, call_id: str) -> list:
+        """A live call's dialogue so far as conversation_archive.Turn_record, oldest first."""
+        return [
+            conversation_archive.Turn_record(*row) for row in self.con.execute(
+                "SELECT role, text, intent, sentiment, ts FROM conversation_turns WHERE call_id = ? ORDER BY seq",
+                (call_id,)
             )
-            self.con.commit()
-            print(f"✓ Updated customer {customer_id}: {status}")
+        ]
+
+    def live_call_count(self) -> int:
+        """Calls with turns that haven't been archived yet."""
+        return self.con.execute("SELECT COUNT(DISTINCT call_id) FROM conversation_turns").fetchone()[0]
+
+    @timed("db_query_seconds", query="archive_conversation")
+    def archive_conversation(self, call_id: str, customer_id=None) -> bool:
+        """
+        Moves a call's dialogue from conversation_turns into conversation_archive as one
+        compressed row. Reading, inserting and deleting happen in one transaction, so a
+        retried call-end (or a stale-call sweep on another worker) can't archive it twice.
+
+        Args:
+            call_id (str): The Vapi call id.
+            customer_id (int, optional): Customer the call was with; defaults to the one stored with the turns.
+
+        Returns:
+            bool: True if the call had turns and they were archived.
+        """
+        try:
+            with self._transaction(0):
+                rows = self.con.execute(
+                    "SELECT customer_id, role, text, intent, sentiment, ts FROM conversation_turns WHERE call_id = ? ORDER BY seq",
+                    (call_id,)
+                ).fetchall()
+                if not rows:
+                    return False
+                if customer_id is None:
+                    customer_id = next((row[0] for row in rows if row[0] is not None), None)
+                turns = [conversation_archive.Turn_record(*row[1:]) for row in rows]
+                self.con.execute(
+                    """
+                    INSERT OR IGNORE INTO conversation_archive (call_id, customer_id, started_at, ended_at, turns, transcript)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    (call_id, customer_id, call_schedule.to_db(datetime.fromtimestamp(turns[0].ts)),
+                     call_schedule.to_db(call_schedule.utc_now()), len(turns), conversation_archive.encode_turns(turns))
+                )
+                self.con.execute("DELETE FROM conversation_turns WHERE call_id = ?", (call_id,))
+            return True
+        except Exception as e:
+            logger.error("Error archiving conversation for call %s: %s", call_id, e)
+            return False
+
+    @timed("db_query_seconds", query="archive_stale_conversations")
+    def archive_stale_conversations(self, idle_seconds: float) -> int:
+        """Archives live calls without a turn for `idle_seconds` (their call-end never arrived). Returns how many."""
+        try:
+            call_ids = [row[0] for row in self.con.execute(
+                "SELECT call_id FROM conversation_turns GROUP BY call_id HAVING MAX(ts) < ?",
+                (time.time() - idle_seconds,)
+            )]
         except Exception as e:
-            print(f"Error updating customer {customer_id}: {e}")
+            logger.error("Error finding stale conversations: %s", e)
+            return 0
+        return sum(self.archive_conversation(call_id) for call_id in call_ids)
+
+    def iter_conversations(self, customer_id=None, since: str | None = None, until: str | None = None, page_size: int = 100):
+        """
+        Yields archived conversations as (id, call_id, customer_id, started_at, ended_at, turns, transcript)
+        in (ended_at, id) order, optionally for one customer and/or an ended_at range [since, until).
+
+        Rows are read a page at a time with keyset pagination on (ended_at, id), which the
+        archive indexes serve directly; no cursor stays open between pages.
+        """
+        conditions, params = [], []
+        if customer_id is not None:
+            conditions.append("customer_id = ?")
+            params.append(customer_id)
+        if since:
+            conditions.append("ended_at >= ?")
+            params.append(since)
+        if until:
+            conditions.append("ended_at < ?")
+            params.append(until)
+        query = f"""
+            SELECT id, call_id, customer_id, started_at, ended_at, turns, transcript FROM conversation_archive
+            WHERE {" AND ".join(conditions + ["(ended_at, id) > (?, ?)"])}
+            ORDER BY ended_at, id LIMIT ?
+            """
+        last = ("", 0)
+        while True:
+            rows = self.con.execute(query, (*params, *last, page_size)).fetchall()
+            if not rows:
+                return
+            yield from rows
+            last = (rows[-1][4], rows[-1][0])
 
     def close(self):
-        """Close database connection"""
-        if self.con:
-            self.con.close()
+        """Close database connections"""
+        for con in self.shards:
+            con.close()
 
 
 if __name__ == "__main__":
+    import sys
+
     try:
-        db = Database()
+        db = Database(seed = "--seed" in sys.argv)
         print("Database test successful!")
-        
+
         print("\nFetching pending customers:")
-        for row in db.fetch_due_customers():
+        for row in db.list_customers(status="Pending"):
             print(f"  {row}")
 
         # Test updating a customer
-        customers = db.fetch_due_customers()
+        customers = db.list_customers(status="Pending")
         if customers:
-            customer_id = customers[0][0]
+            customer_id = customers[0].id
             db.log_call_outcome(customer_id, "SUCCESSFUL", "Customer agreed to pay tomorrow")
             print(f"\nUpdated customer {customer_id}")
-            
+
         print("\nFetching updated customers:")
-        for row in db.fetch_due_customers():
+        for row in db.list_customers(status="Pending"):
             print(f"  {row}")
-            
+
     except Exception as e:
-        print(f"Database test failed: {e}")
\ No newline at end of file
+        print(f"Database test failed: {e}")
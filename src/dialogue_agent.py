@@ -1,18 +1,91 @@
-from groq import Groq
 import os 
 from dotenv import load_dotenv
 import json
+import logging
+import re
+
+from src.services.metrics_service import timer
+from src.services.llm_guard import CALL_TIMEOUT_SECONDS, Circuit_breaker, Latency_tracker, Llm_unavailable, guarded_call
+from src.services.intent_index import Intent_index
+from src.services import metrics_service
+
+logger = logging.getLogger(__name__)
+
 load_dotenv()
 
+INTENT_MODEL = "meta-llama/llama-4-scout-17b-16e-instruct"
+KNOWN_INTENTS = {"AGREES_TO_PAY", "REFUSES_TO_PAY", "REQUESTS_INFO", "END_CONVERSATION", "UNCLEAR"}
+
+## Shared with the offline re-classification job so both score transcripts the same way
+INTENT_CLASSES_PROMPT = """- "AGREES_TO_PAY": User agrees to pay their loan.
+        - "REFUSES_TO_PAY": User explicitly refuses to pay or states they cannot.
+        - "REQUESTS_INFO": User asks for more details about the loan or payment.
+        - "END_CONVERSATION": User wants to end the call.
+        - "UNCLEAR": The user's intent is not clear."""
+
+## Shared by all Dialogue_agent instances in the process: they all talk to the same upstream
+_intent_breaker = Circuit_breaker("intent")
+_intent_latency = Latency_tracker()
+
+## Keyword rules for the local fallback, checked in order (refusals before agreement so
+## that "I can't pay" is not read as "pay").
+_LOCAL_INTENT_RULES = (
+    ("REFUSES_TO_PAY", re.compile(r"\b(can'?t|cannot|won'?t|will not|unable|refuse|not (?:going to|able to) pay|no money|don'?t have|later|problem)\b")),
+    ("END_CONVERSATION", re.compile(r"\b(bye|goodbye|stop calling|hang up|leave me alone|don'?t call)\b")),
+    ("REQUESTS_INFO", re.compile(r"\b(how much|what|when|why|which|amount|details?|due date)\b|\?")),
+    ("AGREES_TO_PAY", re.compile(r"\b(yes|yeah|yep|sure|okay|ok|pay|will do|sounds good|fine)\b")),
+    ("REFUSES_TO_PAY", re.compile(r"\bno\b")),
+)
+
+def call_status_for_intent(intent: str) -> str:
+    """Maps a classified intent to the `call_status` stored for the customer."""
+    if intent == "AGREES_TO_PAY":
+        return "SUCCESSFUL"
+    if intent == "REFUSES_TO_PAY":
+        return "NEEDS FOLLOW-UP"
+    return "UNCLEAR"
+
 class Dialogue_agent:
     """ 
     This is the  intelligent core of the voice bot. It decides what to do next in a conversation.
     This Agent is stateless, it doesn't manage the call or the database.
     """
-    def __init__(self, use_groq = True, api_key=None):
+    def __init__(self, use_groq = True, api_key=None, intent_index = None):
         self.use_groq = use_groq
         self.api_key = api_key or os.getenv("GROQ_API_KEY")
-        self.client = Groq(api_key = self.api_key) if self.use_groq else None
+        self._client = None
+        ## Reuses labels of similar past utterances so most turns skip the LLM call
+        if intent_index is None and use_groq and os.getenv("INTENT_INDEX_ENABLED", "1") == "1":
+            intent_index = Intent_index(
+                path = os.getenv("INTENT_INDEX_PATH", "intent_index.npz"),
+                capacity = int(os.getenv("INTENT_INDEX_CAPACITY", "20000")),
+                threshold = float(os.getenv("INTENT_INDEX_THRESHOLD", "0.92")),
+            )
+        self.intent_index = intent_index
+
+    @property
+    def client(self):
+        """
+        The Groq client, created on first use so that importing and constructing the
+        agent stays cheap (and fork-safe under gunicorn --preload).
+        """
+        if self._client is None and self.use_groq:
+            from groq import Groq
+            ## Retries are handled by llm_guard (hedging), so the SDK must not retry on its own
+            self._client = Groq(api_key = self.api_key, timeout = CALL_TIMEOUT_SECONDS, max_retries = 0)
+        return self._client
+
+    @staticmethod
+    def _classify_intent_locally(transcript: str) -> dict:
+        """
+        Keyword-based intent classifier used when Groq is disabled, too slow or failing.
+        Less accurate than the LLM, but answers instantly so the caller never waits.
+        """
+        transcript_lower = transcript.lower()
+        for intent, pattern in _LOCAL_INTENT_RULES:
+            if pattern.search(transcript_lower):
+                return {"intent": intent}
+        return {"intent": "UNCLEAR"}
 
     def _classify_intent(self, transcript: str, conversation_history: list = None) -> dict:
         """
@@ -21,15 +94,13 @@ class Dialogue_agent:
         """
 
         if not self.use_groq:
-            transcript_lower = transcript.lower()
-
-            if any(word in transcript_lower for word in['yes', 'pay', 'sure', 'okay']):
-                return {"intent": "AGREES_TO_PAY"}
-            elif any(word in transcript_lower for word in ["no", "can't", "later", "problem"]):
-                return {"intent": "REFUSES_TO_PAY"}
-            else:
-                return {"intent": "UNCLEAR"}
-            
+            return self._classify_intent_locally(transcript)
+
+        if self.intent_index is not None:
+            cached_intent = self.intent_index.lookup(transcript)
+            metrics_service.record_cache("intent_index", cached_intent is not None)
+            if cached_intent is not None:
+                return {"intent": cached_intent}
 
         history_prompt = ""
         if conversation_history:
@@ -40,29 +111,33 @@ class Dialogue_agent:
         Transcript : "{transcript}"
             
         Decide among one of the classes of the following JSON keys:
-        - "AGREES_TO_PAY": User agrees to pay their loan.
-        - "REFUSES_TO_PAY": User explicitly refuses to pay or states they cannot.
-        - "REQUESTS_INFO": User asks for more details about the loan or payment.
-        - "END_CONVERSATION": User wants to end the call.
-        - "UNCLEAR": The user's intent is not clear.
+        {INTENT_CLASSES_PROMPT}
 
         Respond with only a single JSON object contianing the key "intent".
         Example: {{"intent: AGREES_TO_PAY"}}
         """
 
+        def request():
+            with timer("llm_request_seconds", agent = "dialogue", model = INTENT_MODEL):
+                response = self.client.chat.completions.create(
+                    model = INTENT_MODEL,
+                    messages = [{"role": "user", "content": prompt}],
+                    temperature = 0.0,
+                    response_format = {"type": "json_object"}
+                )
+            return json.loads(response.choices[0].message.content)
+
         try:
-            response = self.client.chat.completions.create(
-                model = "meta-llama/llama-4-scout-17b-16e-instruct",
-                messages = [{"role": "user", "content": prompt}],
-                temperature = 0.0,
-                response_format = {"type": "json_object"}
-            )
-            
-            result = json.loads(response.choices[0].message.content)
-            return result
-        except Exception as e:
-            print(f"Error classifying intent: {e}")
-            return {"intent": "HUMAN_INTERVENTION_REQUIRED"}
+            ## Bounded by the current turn's latency budget, hedged when slow, skipped while the breaker is open
+            result = guarded_call("intent", request, _intent_breaker, _intent_latency)
+        except Llm_unavailable as e:
+            logger.warning("Intent LLM unavailable, using local classifier: %s", e)
+            return self._classify_intent_locally(transcript)
+
+        ## Only LLM labels are indexed; local fallback guesses would pollute the index
+        if self.intent_index is not None and result.get("intent") in KNOWN_INTENTS:
+            self.intent_index.add(transcript, result["intent"])
+        return result
 
     def get_next_action(self, last_transcript: str, customer_data: dict, conversation_history: list = None, sentiment: str = "NEUTRAL") -> dict:
         """
@@ -0,0 +1,34 @@
+"""
+Changes how many SQLite files (shards) the customer database is split over.
+
+    python -m src.rebalance_shards --db customers.db --shards 4
+
+Stop the API and any dialers first, and restart them afterwards: each process reads the
+bucket -> shard map once when it opens the database. Re-running after an interruption is safe.
+"""
+import argparse
+import logging
+
+from src.database import Database
+from src.services.logging_service import setup_logging
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Move customers between database shards.")
+    parser.add_argument("--db", default = "customers.db", help = "SQLite database file (shard 0)")
+    parser.add_argument("--shards", type = int, required = True, help = "target number of shards")
+    args = parser.parse_args()
+
+    setup_logging()
+    db = Database(args.db)
+    try:
+        stats = db.rebalance(args.shards)
+        logger.info("Rebalanced: %s", stats)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""
+Offline re-classification of the transcripts stored in `customers.notes`.
+
+Run after changing the intent prompt or model to re-score the whole portfolio:
+
+    python -m src.reclassify_job --db customers.db --batch-size 20 --concurrency 4
+
+Transcripts are streamed from the database, packed several to a Groq JSON-mode request,
+sent with bounded concurrency, and the new intent/status written back in batched
+transactions. Progress is checkpointed after every committed write, so an interrupted
+run picks up where it stopped (pass --restart to start over).
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+from src.database import Database
+from src.dialogue_agent import INTENT_CLASSES_PROMPT, INTENT_MODEL, KNOWN_INTENTS, call_status_for_intent
+from src.services.logging_service import setup_logging
+from src.services.metrics_service import timer
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+## Long recordings are cut so that one oversized transcript can't push a batch past the context window
+MAX_TRANSCRIPT_CHARS = 2000
+
+
+class Batch_failed(Exception):
+    """Raised when a batch still fails after all retries; the run stops so it can be resumed."""
+
+
+class Write_failed(Exception):
+    """Raised when some results could not be written; the checkpoint stays before them."""
+
+
+def read_checkpoint(path: str) -> int:
+    """Returns the last customer id that was fully processed (0 if there is no checkpoint)."""
+    try:
+        with open(path) as f:
+            return int(json.load(f)["last_id"])
+    except FileNotFoundError:
+        return 0
+
+
+def write_checkpoint(path: str, last_id: int, model: str):
+    """Atomically records that every row up to `last_id` has been written."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"last_id": last_id, "model": model, "updated_at": time.time()}, f)
+    os.replace(tmp_path, path)
+
+
+def build_prompt(batch: list[tuple]) -> str:
+    """Prompt asking for one intent per (id, transcript) pair in `batch`."""
+    items = [{"id": customer_id, "transcript": notes[:MAX_TRANSCRIPT_CHARS]} for customer_id, notes in batch]
+    return f"""Each item below is the transcript of a customer's reply on a loan collection call.
+        Classify the customer's intent in every transcript as one of:
+        {INTENT_CLASSES_PROMPT}
+
+        Items: {json.dumps(items, ensure_ascii = False)}
+
+        Respond with only a single JSON object of the form
+        {{"results": [{{"id": <item id>, "intent": "<class>"}}, ...]}} with exactly one entry per item.
+        """
+
+
+def classify_batch(client, model: str, batch: list[tuple], retries: int = 3) -> dict:
+    """
+    Classifies a batch of transcripts with a single Groq request.
+
+    Args:
+        client: Groq client.
+        model (str): Model name.
+        batch (list[tuple]): (customer_id, transcript) pairs.
+        retries (int): Attempts before giving up on the batch.
+
+    Returns:
+        dict: customer_id -> intent for every item the model labelled with a known intent.
+
+    Raises:
+        Batch_failed: Every attempt failed.
+    """
+    prompt = build_prompt(batch)
+    expected = {customer_id for customer_id, _ in batch}
+    for attempt in range(1, retries + 1):
+        try:
+            with timer("llm_request_seconds", agent = "reclassify", model = model):
+                response = client.chat.completions.create(
+                    model = model,
+                    messages = [{"role": "user", "content": prompt}],
+                    temperature = 0.0,
+                    response_format = {"type": "json_object"}
+                )
+            results = json.loads(response.choices[0].message.content).get("results", [])
+            intents = {}
+            for item in results:
+                try:
+                    customer_id = int(item["id"])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if customer_id in expected and item.get("intent") in KNOWN_INTENTS:
+                    intents[customer_id] = item["intent"]
+            if len(intents) < len(expected):
+                logger.warning("Batch %d-%d: %d of %d items unlabelled", batch[0][0], batch[-1][0], len(expected) - len(intents), len(expected))
+            return intents
+        except Exception as e:
+            logger.warning("Batch %d-%d attempt %d failed: %s", batch[0][0], batch[-1][0], attempt, e)
+            if attempt < retries:
+                time.sleep(min(30, 2 ** attempt))
+    raise Batch_failed(f"batch {batch[0][0]}-{batch[-1][0]} failed after {retries} attempts")
+
+
+def _batches(rows, size: int):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def run(db: Database, client, model: str = INTENT_MODEL, batch_size: int = 20, concurrency: int = 4,
+        write_every: int = 500, checkpoint_path: str = "reclassify.checkpoint.json", restart: bool = False) -> dict:
+    """
+    Re-classifies every stored transcript after the checkpoint.
+
+    Batches are consumed in submission order, so everything written so far is a contiguous
+    id range and the checkpoint is simply the last id of the latest committed write.
+    At most `concurrency` requests are in flight at once.
+
+    Returns:
+        dict: Counters for the run ('rows', 'updated', 'unlabelled', 'requests').
+    """
+    start_id = 0 if restart else read_checkpoint(checkpoint_path)
+    if start_id:
+        logger.info("Resuming after customer id %d", start_id)
+
+    stats = {"rows": 0, "updated": 0, "unlabelled": 0, "requests": 0}
+    pending_writes = []
+    last_done_id = start_id
+
+    def flush():
+        if not pending_writes:
+            return
+        expected = len(pending_writes)
+        written = db.bulk_update_outcomes(pending_writes)
+        stats["updated"] += written
+        pending_writes.clear()
+        ## A shard whose transaction failed was rolled back: keep the checkpoint so a resumed run redoes these ids
+        if written < expected:
+            raise Write_failed(f"{expected - written} of {expected} results up to id {last_done_id} were not written")
+        write_checkpoint(checkpoint_path, last_done_id, model)
+
+    def collect(batch, future):
+        nonlocal last_done_id
+        intents = future.result()
+        stats["requests"] += 1
+        stats["rows"] += len(batch)
+        stats["unlabelled"] += len(batch) - len(intents)
+        pending_writes.extend((customer_id, intent, call_status_for_intent(intent)) for customer_id, intent in intents.items())
+        last_done_id = batch[-1][0]
+        if len(pending_writes) >= write_every:
+            flush()
+
+    started = time.monotonic()
+    in_flight = deque()
+    try:
+        with ThreadPoolExecutor(max_workers = concurrency, thread_name_prefix = "reclassify") as executor:
+            try:
+                for batch in _batches(db.iter_transcripts(after_id = start_id), batch_size):
+                    in_flight.append((batch, executor.submit(classify_batch, client, model, batch)))
+                    if len(in_flight) >= concurrency:
+                        collect(*in_flight.popleft())
+                while in_flight:
+                    collect(*in_flight.popleft())
+            except BaseException:
+                ## Drop queued batches before the executor exits; only requests already running are waited for
+                executor.shutdown(wait = False, cancel_futures = True)
+                raise
+    finally:
+        ## Persist whatever finished in order, so a failed or interrupted run resumes from there
+        flush()
+
+    elapsed = time.monotonic() - started
+    logger.info("Re-classified %d transcripts in %d requests (%.1fs, %.1f rows/s)",
+                stats["rows"], stats["requests"], elapsed, stats["rows"] / elapsed if elapsed else 0.0)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Re-classify stored call transcripts with the current intent prompt.")
+    parser.add_argument("--db", default = "customers.db", help = "SQLite database file")
+    parser.add_argument("--model", default = INTENT_MODEL)
+    parser.add_argument("--batch-size", type = int, default = 20, help = "transcripts per Groq request")
+    parser.add_argument("--concurrency", type = int, default = 4, help = "Groq requests in flight at once")
+    parser.add_argument("--write-every", type = int, default = 500, help = "rows per write transaction")
+    parser.add_argument("--checkpoint", default = "reclassify.checkpoint.json")
+    parser.add_argument("--restart", action = "store_true", help = "ignore the checkpoint and start from the first row")
+    args = parser.parse_args()
+
+    setup_logging()
+    from groq import Groq
+    ## The SDK's own retries honour Groq's Retry-After on rate limits
+    client = Groq(api_key = os.getenv("GROQ_API_KEY"), timeout = 60, max_retries = 2)
+
+    db = Database(args.db)
+    try:
+        stats = run(db, client, model = args.model, batch_size = args.batch_size, concurrency = args.concurrency,
+                    write_every = args.write_every, checkpoint_path = args.checkpoint, restart = args.restart)
+        logger.info("Done: %s", stats)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,52 @@
 import os
 import json
-from unittest import result
-from groq import Groq
+import logging
+import re
 from dotenv import load_dotenv
 
+from src.services.metrics_service import timer
+from src.services.llm_guard import CALL_TIMEOUT_SECONDS, Circuit_breaker, Latency_tracker, Llm_unavailable, guarded_call, remaining_budget
+
+logger = logging.getLogger(__name__)
+
 load_dotenv()
 
+SENTIMENT_MODEL = "gemma2-9b-it"
+## Sentiment only adds an empathy prefix, so it may use at most this share of the turn budget
+SENTIMENT_BUDGET_SHARE = 0.4
+
+_sentiment_breaker = Circuit_breaker("sentiment")
+_sentiment_latency = Latency_tracker(default_seconds = 0.3)
+
+_NEGATIVE_WORDS = re.compile(r"\b(can'?t|cannot|won'?t|no|not|never|angry|upset|annoy\w*|stress\w*|hard|difficult|lost|broke|sorry|problem|stop|bad|terrible|worried)\b")
+_POSITIVE_WORDS = re.compile(r"\b(yes|sure|okay|ok|great|good|thanks|thank|happy|fine|glad|perfect|absolutely|definitely)\b")
+
 class Sentiment_agent:
     def __init__(self):
         self.api_key = os.getenv("GROQ_API_KEY")
-        self.client = Groq(api_key=self.api_key) if self.api_key else None
-        print(f"Sentiment Agent initiated.")
+        self._client = None
+        logger.info("Sentiment Agent initiated.")
 
-    def analyze_(self, transcript: str) -> str:
+    @property
+    def client(self):
+        """The Groq client, created on first use (None when no API key is configured)."""
+        if self._client is None and self.api_key:
+            from groq import Groq
+            self._client = Groq(api_key=self.api_key, timeout=CALL_TIMEOUT_SECONDS, max_retries=0)
+        return self._client
+
+    @staticmethod
+    def _analyze_locally(transcript: str) -> str:
+        """Word-list sentiment used when Groq can't answer within the turn budget."""
+        text = transcript.lower()
+        score = len(_POSITIVE_WORDS.findall(text)) - len(_NEGATIVE_WORDS.findall(text))
+        if score > 0:
+            return "POSITIVE"
+        if score < 0:
+            return "NEGATIVE"
+        return "NEUTRAL"
+
+    def analyze_sentiment(self, transcript: str) -> str:
         """
         Analyzes the sentiment of a given text using Groq.
 
@@ -34,24 +68,32 @@ class Sentiment_agent:
 
         Sentiment:"""
 
+        def request():
+            with timer("llm_request_seconds", agent = "sentiment", model = SENTIMENT_MODEL):
+                response = self.client.chat.completions.create(
+                    model = SENTIMENT_MODEL,
+                    messages = [{"role": "user", "content": prompt}],
+                    temperature = 0.1,
+                    max_tokens = 10
+                )
+            return response.choices[0].message.content.strip().upper()
+
         try:
-            print(f"Sentiment Agent: Analyzing transcript: '{transcript[:50]}")
-            response = self.client.chat.completions.create(
-                model = "gemma2-9b-it",
-                messages = [{"role": "user", "content": prompt}],
-                temperature = 0.1,
-                max_tokens = 10
+            result_text = guarded_call(
+                "sentiment", request, _sentiment_breaker, _sentiment_latency,
+                max_seconds = remaining_budget() * SENTIMENT_BUDGET_SHARE
             )
 
-            result_text = response.choices[0].message.content.strip().upper()
-
             if result_text in ["POSITIVE", "NEGATIVE", "NEUTRAL"]:
-                print(f"Sentiment Agent: Detected sentiment: {result_text}")
+                logger.debug("Sentiment Agent: Detected sentiment: %s", result_text)
                 return result_text
             else:
-                print(f"Sentiment Agent: Unexpected sentiment result: {result_text}")
+                logger.warning("Sentiment Agent: Unexpected sentiment result: %s", result_text)
                 return "NEUTRAL"
 
+        except Llm_unavailable as e:
+            logger.warning("Sentiment Agent: LLM unavailable, using local word list: %s", e)
+            return self._analyze_locally(transcript)
         except Exception as e:
-            print(f"Sentiment Agent: Error during sentiment analysis: {e}")
+            logger.error("Sentiment Agent: Error during sentiment analysis: %s", e)
             return "NEUTRAL"
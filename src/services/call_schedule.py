@@ -0,0 +1,85 @@
+import logging
+import os
+import random
+from datetime import datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+logger = logging.getLogger(__name__)
+
+## Statuses that still need a call; anything else (SUCCESSFUL, SMS_SENT, ...) is left alone
+CALLABLE_STATUSES = ("Pending", "NEEDS FOLLOW-UP", "UNCLEAR")
+## First retry delay per outcome; doubled for every further attempt up to MAX_RETRY_DELAY
+RETRY_BASE_DELAY = {
+    "NEEDS FOLLOW-UP": timedelta(hours = 4),
+    "UNCLEAR": timedelta(hours = 1),
+}
+MAX_RETRY_DELAY = timedelta(hours = 48)
+MAX_ATTEMPTS = int(os.getenv("MAX_CALL_ATTEMPTS", "5"))
+## How long a claimed customer stays reserved for the dialer that claimed them
+CLAIM_LEASE = timedelta(seconds = int(os.getenv("CALL_CLAIM_LEASE_S", "900")))
+
+## Local calling window, e.g. CALLING_HOURS=09:00-20:00 with CALLING_TZ=Asia/Kolkata (unset = any time)
+CALLING_TZ = ZoneInfo(os.getenv("CALLING_TZ", "UTC"))
+_hours = os.getenv("CALLING_HOURS", "")
+if _hours:
+    _start, _end = (time.fromisoformat(part.strip()) for part in _hours.split("-"))
+    CALLING_WINDOW = (_start, _end)
+else:
+    CALLING_WINDOW = None
+
+## Format of the scheduling timestamps stored in SQLite (UTC, sorts correctly as text)
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def to_db(moment: datetime) -> str:
+    return moment.astimezone(timezone.utc).strftime(TIMESTAMP_FORMAT)
+
+
+def within_calling_hours(moment: datetime | None = None) -> bool:
+    """True if `moment` (default now) falls inside the configured calling window."""
+    if CALLING_WINDOW is None:
+        return True
+    local = (moment or utc_now()).astimezone(CALLING_TZ).time()
+    start, end = CALLING_WINDOW
+    if start <= end:
+        return start <= local < end
+    return local >= start or local < end  ## window spanning midnight
+
+
+def next_calling_time(moment: datetime) -> datetime:
+    """`moment` if it is inside the calling window, otherwise the start of the next window."""
+    if within_calling_hours(moment):
+        return moment
+    local = moment.astimezone(CALLING_TZ)
+    start_today = datetime.combine(local.date(), CALLING_WINDOW[0], tzinfo = CALLING_TZ)
+    return start_today if start_today > local else start_today + timedelta(days = 1)
+
+
+def next_attempt_after(status: str, attempts: int, moment: datetime | None = None) -> datetime | None:
+    """
+    When a customer with this outcome should be called again.
+
+    Args:
+        status (str): The call outcome just recorded.
+        attempts (int): Calls made so far (including the one that produced `status`).
+        moment (datetime, optional): Reference time (default now).
+
+    Returns:
+        datetime | None: The retry time, inside calling hours, or None if no retry is due
+                         (outcome is final or MAX_ATTEMPTS is reached).
+    """
+    base = RETRY_BASE_DELAY.get(status)
+    if base is None or attempts >= MAX_ATTEMPTS:
+        return None
+    delay = min(base * (2 ** max(0, attempts - 1)), MAX_RETRY_DELAY)
+    ## +-10% jitter so customers who failed together aren't all retried in the same minute
+    delay *= random.uniform(0.9, 1.1)
+    return next_calling_time((moment or utc_now()) + delay)
+
+
+## New customers become callable this long before their due date
+LEAD_DAYS = int(os.getenv("CALL_LEAD_DAYS", "3"))
@@ -0,0 +1,36 @@
+import json
+import os
+import time
+import zlib
+from dataclasses import asdict, dataclass, field
+
+## zlib level for archived conversations (6 is zlib's default; 9 saves a little more for more CPU)
+COMPRESSION_LEVEL = int(os.getenv("ARCHIVE_COMPRESSION_LEVEL", "6"))
+## Live calls without a new turn for this long never got call-end; they are archived as they are
+STALE_AFTER_SECONDS = int(os.getenv("ARCHIVE_STALE_AFTER_HOURS", "2")) * 3600
+
+
+@dataclass(slots=True)
+class Turn_record:
+    """One line of a live conversation, stored in `conversation_turns` until the call ends."""
+    role: str                       ## "User" or "Agent"
+    text: str
+    intent: str | None = None       ## set on user turns
+    sentiment: str | None = None    ## set on user turns
+    ts: float = field(default_factory=lambda: round(time.time(), 3))
+
+
+def history_lines(turns: list[Turn_record]) -> list[str]:
+    """The "Role: text" lines the dialogue agent receives as conversation history."""
+    return [f"{turn.role}: {turn.text}" for turn in turns]
+
+
+def encode_turns(turns: list[Turn_record]) -> bytes:
+    """Serialises a conversation into the compressed blob stored in conversation_archive."""
+    payload = json.dumps([asdict(turn) for turn in turns], separators=(",", ":"), ensure_ascii=False)
+    return zlib.compress(payload.encode(), COMPRESSION_LEVEL)
+
+
+def decode_turns(blob: bytes) -> list[dict]:
+    """Inverse of `encode_turns`: the list of turn dicts."""
+    return json.loads(zlib.decompress(blob))
@@ -0,0 +1,195 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+from src.services import metrics_service
+
+logger = logging.getLogger(__name__)
+
+## How often the database event feed is polled while anyone is subscribed
+POLL_SECONDS = int(os.getenv("EVENT_POLL_MS", "500")) / 1000
+## Events a slow subscriber may fall behind by before it is disconnected (it resumes via Last-Event-ID)
+SUBSCRIBER_BUFFER = int(os.getenv("EVENT_SUBSCRIBER_BUFFER", "256"))
+RETENTION_SECONDS = int(os.getenv("EVENT_RETENTION_HOURS", "24")) * 3600
+HEARTBEAT_SECONDS = 15
+REPLAY_PAGE = 500
+PRUNE_EVERY_SECONDS = 600
+
+
+class Subscriber:
+    """One /events connection: a bounded queue fed by the broker."""
+
+    def __init__(self, buffer_size: int):
+        self.queue = asyncio.Queue(maxsize = buffer_size)
+        self.overflowed = False
+        self.cursor = None      ## feed position when it joined; later events arrive through the queue
+
+
+class Event_broker:
+    """
+    Fans the persisted `events` feed out to Server-Sent Events subscribers.
+
+    Events are written to the database by whichever process handles the write, each on
+    the shard of the customer it is about, so each worker runs one tailer task that polls
+    every shard for new rows (only while it has subscribers) and copies them into every
+    subscriber's bounded queue. A position in the feed is the last id seen on each shard,
+    sent to the browser as the SSE id ("12.0.7"). A subscriber that can't keep up is
+    disconnected rather than buffered without limit; the browser's EventSource reconnects
+    with Last-Event-ID and the missed events are replayed from the database.
+    """
+
+    def __init__(self, get_db, poll_seconds: float = POLL_SECONDS, buffer_size: int = SUBSCRIBER_BUFFER):
+        self.get_db = get_db
+        self.poll_seconds = poll_seconds
+        self.buffer_size = buffer_size
+        self.cursor = None      ## per-shard id of the newest event published
+        self._subscribers = set()
+        self._task = None
+        self._last_prune = 0.0
+
+        metrics_service.register_gauge("event_subscribers", lambda: len(self._subscribers), "Connected /events subscribers.")
+
+    async def subscribe(self) -> Subscriber:
+        subscriber = Subscriber(self.buffer_size)
+        if self._task is None or self._task.done():
+            ## The tailer stopped polling when the last subscriber left, so the cursor may be hours
+            ## old; restarting from it would push that whole backlog into the new queue at once.
+            ## Live subscribers start from "now" (a reconnect replays its gap from the database).
+            newest = (await asyncio.to_thread(self.get_db().event_id_range))[1]
+            if self._task is None or self._task.done():
+                self.cursor = newest
+                self._task = asyncio.create_task(self._tail())
+        ## Snapshot and registration with no await in between: every event after the
+        ## snapshot reaches the queue, every event up to it is covered by the cursor
+        subscriber.cursor = list(self.cursor)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self._subscribers.discard(subscriber)
+
+    async def _tail(self):
+        """Polls the event table and fans new rows out; exits when the last subscriber leaves."""
+        while self._subscribers:
+            try:
+                events = await asyncio.to_thread(self.get_db().fetch_events_after, self.cursor)
+                for event in events:
+                    self.publish(event)
+                if time.monotonic() - self._last_prune > PRUNE_EVERY_SECONDS:
+                    self._last_prune = time.monotonic()
+                    await asyncio.to_thread(self.get_db().prune_events, RETENTION_SECONDS)
+                if len(events) == 0:
+                    await asyncio.sleep(self.poll_seconds)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Event tailer error: %s", e)
+                await asyncio.sleep(self.poll_seconds)
+
+    def publish(self, event: dict):
+        advance(self.cursor, event)
+        for subscriber in list(self._subscribers):
+            try:
+                subscriber.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                subscriber.overflowed = True
+                self._subscribers.discard(subscriber)
+                metrics_service.inc("event_subscribers_dropped_total")
+                logger.warning("Dropped a slow /events subscriber")
+
+    async def stream(self, last_event_id: str | None):
+        """
+        Yields Server-Sent Events text for one connection.
+
+        With `last_event_id` (from the Last-Event-ID header) events after it are replayed
+        from the database first. If some were already pruned, or the id doesn't match this
+        database's shards, a `reset` event tells the client to reload its lists. Then live
+        events follow, with a comment line as heartbeat so proxies keep the connection open.
+        """
+        subscriber = await self.subscribe()
+        try:
+            cursor = subscriber.cursor
+            yield f"retry: {int(self.poll_seconds * 1000) + 2500}\n\n"
+
+            if last_event_id is not None:
+                oldest, _ = await asyncio.to_thread(self.get_db().event_id_range)
+                resumed = parse_cursor(last_event_id)
+                if resumed is None or len(resumed) != len(oldest):
+                    yield format_event(RESET_EVENT, cursor)
+                else:
+                    if any(first > seen + 1 for first, seen in zip(oldest, resumed) if first):
+                        resumed = [max(seen, first - 1) for first, seen in zip(oldest, resumed)]
+                        yield format_event(RESET_EVENT, resumed)
+                    ## Replay up to what the tailer had published when we subscribed; anything newer reaches our queue
+                    until, cursor = cursor, resumed
+                    while True:
+                        events = await asyncio.to_thread(self.get_db().fetch_events_after, cursor, REPLAY_PAGE, until)
+                        for event in events:
+                            advance(cursor, event)
+                            yield format_event(event, cursor)
+                        if len(events) < REPLAY_PAGE:
+                            break
+
+            while not subscriber.overflowed:
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), timeout = HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if not advance(cursor, event):
+                    continue
+                yield format_event(event, cursor)
+        finally:
+            self.unsubscribe(subscriber)
+
+    async def close(self):
+        self._subscribers.clear()
+        if self._task is not None:
+            self._task.cancel()
+
+
+RESET_EVENT = {"id": None, "shard": None, "type": "reset", "customer_id": None, "payload": "{}", "created_at": None}
+
+
+def advance(cursor: list[int], event: dict) -> bool:
+    """Moves `cursor` past `event`. Returns False if the cursor had already seen it."""
+    shard = event.get("shard", 0)
+    if shard >= len(cursor):
+        cursor.extend([0] * (shard + 1 - len(cursor)))
+    if event["id"] <= cursor[shard]:
+        return False
+    cursor[shard] = event["id"]
+    return True
+
+
+def encode_cursor(cursor: list[int]) -> str:
+    return ".".join(str(seen) for seen in cursor)
+
+
+def parse_cursor(text: str) -> list[int] | None:
+    """Inverse of `encode_cursor`; None for anything that isn't a cursor."""
+    try:
+        return [int(part) for part in text.split(".")]
+    except ValueError:
+        return None
+
+
+def format_event(event: dict, cursor: list[int]) -> str:
+    """
+    Encodes a stored event as one SSE message. The SSE id is the feed position after
+    this event (`cursor`), which is what EventSource resends on reconnect.
+    """
+    data = {
+        "id": event["id"],
+        "shard": event.get("shard", 0),
+        "type": event["type"],
+        "customer_id": event["customer_id"],
+        "data": json.loads(event["payload"]),
+        "created_at": event["created_at"],
+    }
+    return f"id: {encode_cursor(cursor)}\nevent: {event['type']}\ndata: {json.dumps(data)}\n\n"
+
+
+metrics_service.describe("event_subscribers_dropped_total", "/events subscribers disconnected for falling behind.")
@@ -0,0 +1,108 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+
+from src.services import metrics_service
+
+logger = logging.getLogger(__name__)
+
+## How often a duplicate delivery re-reads the shared table while the first attempt runs
+POLL_SECONDS = 0.1
+PRUNE_EVERY_SECONDS = 60
+
+
+def message_key(call_id: str, message: dict) -> str:
+    """
+    Identity of one webhook delivery: the call id plus a digest of the message body.
+
+    Vapi re-sends the same message (same timestamp, same transcript) when it retries,
+    while two separate utterances differ at least in their timestamp.
+    """
+    body = json.dumps(message, sort_keys = True, separators = (",", ":"), default = str)
+    return f"{call_id}:{hashlib.sha1(body.encode()).hexdigest()}"
+
+
+class Idempotency_cache:
+    """
+    Remembers recently processed webhook deliveries and the response each one produced.
+
+    The deliveries live in the shared `webhook_deliveries` table, so a retry is recognised
+    whichever gunicorn worker it lands on. The first attempt claims the key (INSERT OR
+    IGNORE semantics) and stores its response when done; a retry that finds the key waits
+    for that response, polling the table, instead of processing the message again. So a
+    retry after a slow Groq call never repeats the LLM work, the conversation history
+    append or the payment SMS.
+
+    Entries expire after `ttl_seconds` and are deleted in SQL. A delivery whose processing
+    raised is forgotten, so Vapi's next retry runs it again. A retry that waits longer than
+    `wait_seconds` gets an empty reply (the first attempt still answers its own request).
+    """
+
+    def __init__(self, get_db, ttl_seconds: float | None = None, wait_seconds: float | None = None):
+        if ttl_seconds is None:
+            ttl_seconds = int(os.getenv("WEBHOOK_DEDUPE_TTL_S", "600"))
+        if wait_seconds is None:
+            wait_seconds = int(os.getenv("WEBHOOK_DEDUPE_WAIT_S", "20"))
+        self.get_db = get_db
+        self.ttl_seconds = ttl_seconds
+        self.wait_seconds = wait_seconds
+        self._last_prune = 0.0
+
+    async def run(self, key: str, handler, *args):
+        """
+        Returns `await handler(*args)`, computed at most once per `key` within the TTL.
+
+        Args:
+            key (str): Delivery identity, see `message_key`.
+            handler: Coroutine function that processes the delivery; its result must be JSON-serialisable.
+
+        Returns:
+            The handler's response (the stored one for a duplicate delivery).
+        """
+        db = self.get_db()
+        deadline = time.monotonic() + self.wait_seconds
+        waited = False
+        while True:
+            now = time.time()
+            if now - self._last_prune > PRUNE_EVERY_SECONDS:
+                self._last_prune = now
+                await asyncio.to_thread(db.prune_deliveries, now - self.ttl_seconds)
+
+            if await asyncio.to_thread(db.claim_delivery, key, now, now - self.ttl_seconds):
+                return await self._process(db, key, handler, *args)
+
+            ## Someone else has it: wait for the stored response. If the key disappears the
+            ## other attempt failed, and this delivery claims it again.
+            while True:
+                claimed, response = await asyncio.to_thread(db.get_delivery, key)
+                if not claimed:
+                    break
+                if response is not None:
+                    metrics_service.inc("webhook_duplicates_total", labels = {"state": "in_flight" if waited else "completed"})
+                    logger.info("Duplicate webhook delivery, reusing the original response")
+                    return json.loads(response)
+                if time.monotonic() > deadline:
+                    metrics_service.inc("webhook_duplicates_total", labels = {"state": "timed_out"})
+                    logger.warning("Duplicate webhook delivery still processing after %ss, answering empty", self.wait_seconds)
+                    return {}
+                waited = True
+                await asyncio.sleep(POLL_SECONDS)
+
+    async def _process(self, db, key: str, handler, *args):
+        try:
+            result = await handler(*args)
+        except BaseException:
+            ## shield: a cancelled request must still release the key for Vapi's retry
+            await asyncio.shield(asyncio.to_thread(db.forget_delivery, key))
+            raise
+        try:
+            await asyncio.to_thread(db.finish_delivery, key, json.dumps(result, default = str))
+        except Exception as e:
+            logger.error("Could not store the response of webhook delivery %s: %s", key, e)
+        return result
+
+
+metrics_service.describe("webhook_duplicates_total", "Webhook deliveries answered from the shared delivery table.")
@@ -0,0 +1,210 @@
+import logging
+import os
+import re
+import threading
+import zlib
+
+from src.services import metrics_service
+
+try:
+    import numpy as np
+except ImportError:  ## The index is an optimization; without NumPy every turn goes to Groq
+    np = None
+
+logger = logging.getLogger(__name__)
+
+_NON_WORD = re.compile(r"[^a-z0-9' ]+")
+## Typographic apostrophes (phone keyboards, ASR output) are read as the ASCII one, so "can’t" stays one word
+_APOSTROPHES = str.maketrans({"\u2019": "'", "\u2018": "'", "\u02bc": "'", "`": "'"})
+## Words that flip the meaning of a reply ("I can pay" / "I cannot pay" are otherwise near-identical
+## vectors). Contracted and spelled-out forms of "not" count as the same negator.
+_NOT_WORDS = {"not", "cannot", "cant", "wont", "dont", "didnt", "doesnt", "isnt", "wasnt", "arent",
+              "shouldnt", "couldnt", "wouldnt", "havent", "hasnt", "unable", "nahi", "nahin"}
+_OTHER_NEGATIONS = {"no", "never", "nothing", "none", "nobody", "neither", "nor"}
+## Bumped whenever normalisation or negation detection changes, so saved indexes built the old way are dropped
+INDEX_FORMAT = 2
+
+
+def _normalize(text: str) -> str:
+    return _NON_WORD.sub(" ", text.lower().translate(_APOSTROPHES)).strip()
+
+
+def negation_signature(text: str) -> str:
+    """The set of negating words in `text` (as one string); replies only share a label if these match."""
+    found = set()
+    words = _normalize(text).split()
+    for i, word in enumerate(words):
+        ## A contraction split by some other apostrophe-like character: "can t", "won t", "don t"
+        split_not = word == "t" and i > 0 and words[i - 1].replace("'", "") + "t" in _NOT_WORDS
+        if split_not or word.endswith("n't") or word.replace("'", "") in _NOT_WORDS:
+            found.add("not")
+        elif word in _OTHER_NEGATIONS:
+            found.add(word)
+    return " ".join(sorted(found))
+
+
+class Intent_index:
+    """
+    Nearest-neighbour cache of intent labels previously produced by the LLM.
+
+    Each transcript is embedded as a hashed bag of words and character 3-grams
+    (L2-normalised, float32), so differently phrased versions of the same answer
+    ("yeah I'll pay it", "yes I will pay that") land close together. A lookup is a single
+    matrix-vector product over all stored vectors; a neighbour whose cosine similarity is
+    at least `threshold` donates its label and the LLM call is skipped, but only if both
+    texts contain the same negating words: a bag of n-grams barely notices a "not", and
+    reusing an agreement label for a refusal would send a payment link.
+
+    The index is capped at `capacity` entries (least recently used entries are replaced),
+    can be updated one entry at a time and is persisted to an .npz file.
+    """
+
+    def __init__(self, path: str | None = None, capacity: int = 20000, dim: int = 256,
+                 threshold: float = 0.92, save_every: int = 200):
+        self.path = path
+        self.capacity = capacity
+        self.dim = dim
+        self.threshold = threshold
+        self.save_every = save_every
+        self.enabled = np is not None
+        self._lock = threading.Lock()
+        self._size = 0
+        self._clock = 0
+        self._unsaved = 0
+        self._labels = [None] * capacity
+        self._negations = [None] * capacity
+        if not self.enabled:
+            logger.warning("NumPy not available, intent similarity index disabled")
+            return
+        self._vectors = np.zeros((capacity, dim), dtype = np.float32)
+        self._last_used = np.zeros(capacity, dtype = np.int64)
+        if path and os.path.exists(path):
+            self.load(path)
+
+        metrics_service.register_gauge("intent_index_entries", lambda: self._size, "Labelled utterances in the intent similarity index.", aggregate = "max")
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _embed(self, text: str):
+        """Hashed word + character 3-gram vector for `text` (None if it has no content)."""
+        text = _normalize(text)
+        if not text:
+            return None
+        vector = np.zeros(self.dim, dtype = np.float32)
+        features = text.split()
+        padded = f" {text} "
+        features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+        ## crc32 rather than hash(): it is stable across processes, which the on-disk index needs
+        buckets = [zlib.crc32(feature.encode()) % self.dim for feature in features]
+        np.add.at(vector, buckets, 1.0)
+        np.log1p(vector, out = vector)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def lookup(self, text: str) -> str | None:
+        """
+        Returns the label of the most similar stored utterance, or None if none is similar enough.
+        """
+        if not self.enabled or self._size == 0:
+            return None
+        vector = self._embed(text)
+        if vector is None:
+            return None
+        negation = negation_signature(text)
+        with self._lock:
+            scores = self._vectors[:self._size] @ vector
+            candidates = np.flatnonzero(scores >= self.threshold)
+            ## Most similar first; skip neighbours whose negations differ
+            for slot in candidates[np.argsort(scores[candidates])[::-1]]:
+                if self._negations[slot] == negation:
+                    self._clock += 1
+                    self._last_used[slot] = self._clock
+                    return self._labels[slot]
+            return None
+
+    def add(self, text: str, label: str):
+        """
+        Stores an LLM-labelled utterance. A near-duplicate entry is relabelled in place;
+        when the index is full the least recently used entry is replaced.
+        """
+        if not self.enabled:
+            return
+        vector = self._embed(text)
+        if vector is None:
+            return
+        negation = negation_signature(text)
+        with self._lock:
+            self._clock += 1
+            slot = None
+            if self._size:
+                scores = self._vectors[:self._size] @ vector
+                best = int(np.argmax(scores))
+                if scores[best] >= 0.99 and self._negations[best] == negation:
+                    slot = best
+            if slot is None:
+                if self._size < self.capacity:
+                    slot = self._size
+                    self._size += 1
+                else:
+                    slot = int(np.argmin(self._last_used))
+                    metrics_service.inc("intent_index_evictions_total")
+            self._vectors[slot] = vector
+            self._labels[slot] = label
+            self._negations[slot] = negation
+            self._last_used[slot] = self._clock
+            self._unsaved += 1
+            should_save = self.path and self._unsaved >= self.save_every
+
+        if should_save:
+            self.save()
+
+    def save(self, path: str | None = None):
+        """Writes the index atomically (temp file + rename) to `path` or the configured path."""
+        path = path or self.path
+        if not self.enabled or not path:
+            return
+        with self._lock:
+            size = self._size
+            vectors = self._vectors[:size].copy()
+            labels = np.array(self._labels[:size], dtype = object)
+            negations = np.array(self._negations[:size], dtype = object)
+            last_used = self._last_used[:size].copy()
+            self._unsaved = 0
+        tmp_path = f"{path}.tmp.{os.getpid()}"
+        try:
+            with open(tmp_path, "wb") as f:
+                np.savez(f, vectors = vectors, labels = labels.astype(str), negations = negations.astype(str),
+                         last_used = last_used, format = np.array(INDEX_FORMAT))
+            os.replace(tmp_path, path)
+            logger.debug("Saved intent index (%d entries) to %s", size, path)
+        except Exception as e:
+            logger.error("Error saving intent index to %s: %s", path, e)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def load(self, path: str):
+        """Loads entries saved by `save`, keeping the most recently used ones if over capacity."""
+        try:
+            with np.load(path) as data:
+                if "format" not in data or int(data["format"]) != INDEX_FORMAT:
+                    ## Built with older negation checks; its labels may already mix agreements and refusals
+                    logger.warning("Ignoring intent index %s saved in an older format", path)
+                    return
+                vectors, labels, last_used = data["vectors"], data["labels"], data["last_used"]
+                negations = data["negations"]
+        except Exception as e:
+            logger.error("Error loading intent index from %s: %s", path, e)
+            return
+        if vectors.shape[1:] != (self.dim,):
+            logger.warning("Ignoring intent index %s built with a different dimension", path)
+            return
+        keep = np.argsort(last_used)[-self.capacity:]
+        with self._lock:
+            self._size = len(keep)
+            self._vectors[:self._size] = vectors[keep]
+            self._last_used[:self._size] = last_used[keep]
+            self._labels[:self._size] = [str(label) for label in labels[keep]]
+            self._negations[:self._size] = [str(negation) for negation in negations[keep]]
+            self._clock = int(last_used.max()) if len(last_used) else 0
+        logger.info("Loaded intent index with %d entries from %s", self._size, path)
@@ -0,0 +1,202 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+from src.services import metrics_service
+
+logger = logging.getLogger(__name__)
+
+## Total time the agents may spend on Groq for one live-call turn (sentiment + intent).
+TURN_BUDGET_SECONDS = int(os.getenv("LLM_TURN_BUDGET_MS", "1500")) / 1000
+## Hard client-side timeout for a single Groq request, also used outside live calls.
+CALL_TIMEOUT_SECONDS = float(os.getenv("LLM_CALL_TIMEOUT_S", "8"))
+## Send a second (hedged) request once the first is slower than this percentile.
+HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.9"))
+BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_S", "30"))
+
+_deadline = contextvars.ContextVar("llm_turn_deadline", default = None)
+_executor = ThreadPoolExecutor(max_workers = int(os.getenv("LLM_MAX_WORKERS", "16")), thread_name_prefix = "llm")
+
+
+class Llm_unavailable(Exception):
+    """Raised when Groq can't answer in time (budget spent, breaker open or every attempt failed)."""
+
+
+class Latency_tracker:
+    """Rolling window of recent successful latencies used to pick the hedging delay."""
+
+    def __init__(self, window: int = 200, default_seconds: float = 0.6, min_samples: int = 20):
+        self._samples = deque(maxlen = window)
+        self._lock = threading.Lock()
+        self.default_seconds = default_seconds
+        self.min_samples = min_samples
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p: float) -> float:
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return self.default_seconds
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+class Circuit_breaker:
+    """
+    Stops sending requests to Groq after `failure_threshold` consecutive failures.
+    After `reset_seconds` a single trial request is let through (half-open); its
+    outcome closes the breaker again or re-opens it.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURES, reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_progress = False
+        self._lock = threading.Lock()
+        metrics_service.set_gauge("llm_breaker_open", 0, {"upstream": name}, aggregate = "max")
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self.reset_seconds and not self._trial_in_progress:
+                self._trial_in_progress = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info("Circuit breaker %s closed", self.name)
+                metrics_service.set_gauge("llm_breaker_open", 0, {"upstream": self.name})
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_progress = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_progress = False
+            if self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning("Circuit breaker %s opened after %d failures", self.name, self._failures)
+                    metrics_service.set_gauge("llm_breaker_open", 1, {"upstream": self.name})
+                self._opened_at = time.monotonic()
+
+
+@contextmanager
+def turn_budget(seconds: float = TURN_BUDGET_SECONDS):
+    """
+    Sets the latency budget shared by every guarded LLM call made inside the block.
+
+    Example:
+        with turn_budget():
+            sentiment = sentiment_agent.analyze_sentiment(text)
+            plan = dialogue_agent.get_next_action(text, customer)
+    """
+    token = _deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_budget() -> float:
+    """Seconds left in the current turn budget (CALL_TIMEOUT_SECONDS when no budget is set)."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return CALL_TIMEOUT_SECONDS
+    return max(0.0, deadline - time.monotonic())
+
+
+def guarded_call(name: str, func, breaker: Circuit_breaker, tracker: Latency_tracker, max_seconds: float | None = None):
+    """
+    Calls `func()` (a blocking Groq request) within the remaining turn budget.
+
+    If the first attempt is still running after the tracker's HEDGE_PERCENTILE latency,
+    an identical second request is sent and whichever answers first wins. A first
+    attempt that fails quickly is retried the same way.
+
+    Args:
+        name (str): Label for metrics, e.g. "intent".
+        func (callable): Zero-argument function performing the request.
+        breaker (Circuit_breaker): Breaker guarding this upstream.
+        tracker (Latency_tracker): Latency history used for the hedge delay.
+        max_seconds (float, optional): Further cap on the time this call may use.
+
+    Returns:
+        The first successful result.
+
+    Raises:
+        Llm_unavailable: The breaker is open, the budget ran out, or all attempts failed.
+    """
+    budget = remaining_budget()
+    if max_seconds is not None:
+        budget = min(budget, max_seconds)
+    if budget <= 0:
+        metrics_service.inc("llm_fallbacks_total", labels = {"call": name, "reason": "budget"})
+        raise Llm_unavailable(f"{name}: no latency budget left")
+    if not breaker.allow():
+        metrics_service.inc("llm_fallbacks_total", labels = {"call": name, "reason": "breaker_open"})
+        raise Llm_unavailable(f"{name}: circuit breaker open")
+
+    start = time.monotonic()
+    deadline = start + budget
+
+    def attempt():
+        attempt_start = time.monotonic()
+        result = func()
+        tracker.record(time.monotonic() - attempt_start)
+        return result
+
+    pending = {_executor.submit(attempt)}
+    hedge_at = start + tracker.percentile(HEDGE_PERCENTILE)
+    hedged = False
+    last_error = None
+
+    while pending:
+        now = time.monotonic()
+        if now >= deadline:
+            break
+        wait_until = hedge_at if not hedged and hedge_at < deadline else deadline
+        done, pending = wait(pending, timeout = max(0.0, wait_until - now), return_when = FIRST_COMPLETED)
+
+        for future in done:
+            error = future.exception()
+            if error is None:
+                breaker.record_success()
+                return future.result()
+            last_error = error
+
+        ## Hedge when the first attempt is slow, or retry once straight away if it failed
+        now = time.monotonic()
+        if not hedged and now < deadline and (not pending or now >= hedge_at):
+            hedged = True
+            pending.add(_executor.submit(attempt))
+            metrics_service.inc("llm_hedged_requests_total", labels = {"call": name})
+
+        if not pending:
+            break
+
+    for future in pending:
+        future.cancel()
+    breaker.record_failure()
+    reason = "timeout" if last_error is None else "error"
+    metrics_service.inc("llm_fallbacks_total", labels = {"call": name, "reason": reason})
+    raise Llm_unavailable(f"{name}: {last_error or 'latency budget exceeded'}")
+
+
+metrics_service.describe("llm_fallbacks_total", "LLM calls answered by the local fallback, by reason.")
+metrics_service.describe("llm_breaker_open", "1 while the circuit breaker for an upstream model is open.")
+metrics_service.describe("llm_hedged_requests_total", "Second (hedged) Groq requests sent after a slow first attempt.")
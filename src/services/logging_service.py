@@ -0,0 +1,158 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+from src.services import metrics_service
+
+## Per-request context attached to every log record produced while it is set.
+## contextvars follow asyncio tasks and are copied into threadpool workers.
+call_id_var = contextvars.ContextVar("call_id", default = None)
+customer_id_var = contextvars.ContextVar("customer_id", default = None)
+
+## Attributes present on every LogRecord; anything else was passed through `extra=`.
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "call_id", "customer_id"}
+
+_listener = None
+_queue = None
+_queue_handler = None
+_stream_handler = None
+
+
+class Context_filter(logging.Filter):
+    """Copies the call_id / customer_id context variables onto the record."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.call_id = call_id_var.get()
+        record.customer_id = customer_id_var.get()
+        return True
+
+
+class Json_formatter(logging.Formatter):
+    """Renders a record as a single JSON line. Runs on the background writer thread."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "call_id", None) is not None:
+            entry["call_id"] = record.call_id
+        if getattr(record, "customer_id", None) is not None:
+            entry["customer_id"] = record.customer_id
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        elif record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default = str)
+
+
+class Text_formatter(logging.Formatter):
+    """Human readable variant for local development (LOG_FORMAT=text)."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        context = []
+        if getattr(record, "call_id", None) is not None:
+            context.append(f"call_id={record.call_id}")
+        if getattr(record, "customer_id", None) is not None:
+            context.append(f"customer_id={record.customer_id}")
+        extras = {k: v for k, v in record.__dict__.items() if k not in _RESERVED_ATTRS and not k.startswith("_")}
+        if extras:
+            context.append(json.dumps(extras, default = str, indent = 2))
+        return f"{line} {' '.join(context)}" if context else line
+
+
+class Dropping_queue_handler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that never blocks the caller: when the queue is full the record
+    is dropped and counted instead of stalling the event loop.
+    """
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics_service.inc("log_records_dropped_total")
+
+    def prepare(self, record):
+        ## Merge the message with its args here so later mutation of the args can't
+        ## change what gets logged, but leave the expensive formatting to the writer thread.
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_text = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(level: str | None = None, fmt: str | None = None, max_queue: int = 10000):
+    """
+    Routes all logging through a bounded queue drained by a background writer thread.
+
+    Safe to call more than once; only the first call installs handlers.
+
+    Args:
+        level (str, optional): Root log level. Defaults to the LOG_LEVEL env var or INFO.
+        fmt (str, optional): "json" (default, LOG_FORMAT env var) or "text".
+        max_queue (int): Records buffered before new ones are dropped.
+    """
+    global _listener, _queue, _queue_handler, _stream_handler
+    if _listener is not None:
+        return
+
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    fmt = (fmt or os.getenv("LOG_FORMAT", "json")).lower()
+
+    _stream_handler = logging.StreamHandler(sys.stdout)
+    if fmt == "text":
+        _stream_handler.setFormatter(Text_formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    else:
+        _stream_handler.setFormatter(Json_formatter())
+
+    _queue = queue.Queue(maxsize = max_queue)
+    _queue_handler = Dropping_queue_handler(_queue)
+    _queue_handler.addFilter(Context_filter())
+
+    root = logging.getLogger()
+    root.handlers = [_queue_handler]
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(_queue, _stream_handler, respect_handler_level = False)
+    _listener.start()
+    atexit.register(lambda: _listener.stop())
+
+    ## Threads do not survive fork(): when gunicorn --preload forks workers from a master
+    ## that already imported the app, each worker needs its own queue and writer thread.
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child = _restart_after_fork)
+
+    metrics_service.register_gauge("log_queue_depth", lambda: _queue.qsize(), "Log records waiting for the background writer.")
+
+
+def _restart_after_fork():
+    global _listener, _queue
+    _queue = queue.Queue(maxsize = _queue.maxsize)
+    _queue_handler.queue = _queue
+    _listener = logging.handlers.QueueListener(_queue, _stream_handler, respect_handler_level = False)
+    _listener.start()
+
+
+def bind_call(call_id):
+    """Attaches call_id to the current request context (each request runs in its own task context)."""
+    call_id_var.set(call_id)
+
+
+def bind_customer(customer_id):
+    """Attaches customer_id to the current context once it becomes known mid-request."""
+    customer_id_var.set(customer_id)
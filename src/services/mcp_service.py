@@ -1,24 +1,51 @@
 import os 
-from twilio.rest import Client
-from twilio.base.exceptions import TwilioRestException
+import logging
+import threading
+
+from src.services.metrics_service import timer
+
+logger = logging.getLogger(__name__)
 
 TWILIO_SID = os.getenv("TWILIO_SID")
 TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
 TWILIO_PHONE_NUMBER = os.getenv("TWILIO_PHONE_NUMBER")
 
-try:
-    if not all([TWILIO_SID, TWILIO_AUTH_TOKEN, TWILIO_PHONE_NUMBER]):
-        raise ValueError("Twilio credentials (SID, AUTH_TOKEN, PHONE_NUMBER) are not fully set.")
-    
-    twilio_client = Client(TWILIO_SID, TWILIO_AUTH_TOKEN)
-    print("Twilio client initialized successfully.")
+## The Twilio SDK is slow to import and its client holds an HTTP session, so both are
+## deferred until the first SMS / lookup instead of happening at import time.
+_twilio_client = None
+_twilio_initialized = False
+_twilio_lock = threading.Lock()
+
+def get_twilio_client():
+    """
+    Returns the shared Twilio client, initializing it on first use.
+
+    Returns:
+        Client | None: The Twilio client, or None if credentials are missing or invalid.
+    """
+    global _twilio_client, _twilio_initialized
+    if _twilio_initialized:
+        return _twilio_client
+
+    with _twilio_lock:
+        if _twilio_initialized:
+            return _twilio_client
+        try:
+            if not all([TWILIO_SID, TWILIO_AUTH_TOKEN, TWILIO_PHONE_NUMBER]):
+                raise ValueError("Twilio credentials (SID, AUTH_TOKEN, PHONE_NUMBER) are not fully set.")
 
-except ValueError as e:
-    print(f"ERROR: {e}")
-    twilio_client = None
-except Exception as e:
-    print(f"Twilio initialization error: {e}")
-    twilio_client = None
+            from twilio.rest import Client
+            _twilio_client = Client(TWILIO_SID, TWILIO_AUTH_TOKEN)
+            logger.info("Twilio client initialized successfully.")
+
+        except ValueError as e:
+            logger.warning("%s", e)
+            _twilio_client = None
+        except Exception as e:
+            logger.error("Twilio initialization error: %s", e)
+            _twilio_client = None
+        _twilio_initialized = True
+    return _twilio_client
 
 def send_sms(to_number: str, message: str) -> bool:
     """
@@ -33,25 +60,29 @@ def send_sms(to_number: str, message: str) -> bool:
     Returns:
         bool: True if the message was sent successfully, False otherwise.
     """
+    twilio_client = get_twilio_client()
     if not twilio_client:
-        print(" Cannot send SMS: Twilio client is not initialized.")
+        logger.error("Cannot send SMS: Twilio client is not initialized.")
         return False
     
+    from twilio.base.exceptions import TwilioRestException
+
     try:
-        twilio_client.messages.create(
-            to = to_number,
-            from_ = TWILIO_PHONE_NUMBER,
-            body = message
-        )
+        with timer("external_call_seconds", service = "twilio", operation = "send_sms"):
+            twilio_client.messages.create(
+                to = to_number,
+                from_ = TWILIO_PHONE_NUMBER,
+                body = message
+            )
 
-        print(f"SMS sent successfully to {to_number}")
+        logger.info("SMS sent successfully to %s", to_number)
         return True
     
     except TwilioRestException as e:
-        print(f"Failed to send SMS to {to_number}. Twilio Error: {e}")
+        logger.error("Failed to send SMS to %s. Twilio Error: %s", to_number, e)
         return False
     except Exception as e:
-        print(f"An unexpected error occurred while sending SMS to {to_number}: {e}")
+        logger.error("An unexpected error occurred while sending SMS to %s: %s", to_number, e)
         return False
     
 def lookup_number(phone_number: str) -> dict | None:
@@ -69,12 +100,16 @@ def lookup_number(phone_number: str) -> dict | None:
                       or None if the lookup fails.
     """
 
+    twilio_client = get_twilio_client()
     if not twilio_client:
-        print("Cannot lookup number since twilio client is not initialized.")
+        logger.error("Cannot lookup number since twilio client is not initialized.")
         return None
     
+    from twilio.base.exceptions import TwilioRestException
+
     try:
-        lookup_data = twilio_client.lookups.v2.phone_numbers(phone_number).fetch()
+        with timer("external_call_seconds", service = "twilio", operation = "lookup_number"):
+            lookup_data = twilio_client.lookups.v2.phone_numbers(phone_number).fetch()
 
         result = {
             "valid": lookup_data.valid,
@@ -83,15 +118,15 @@ def lookup_number(phone_number: str) -> dict | None:
             "type": lookup_data.line_type_intelligence.get('type') if lookup_data.line_type_intelligence else 'unknown'
         }
 
-        print(f"Phone number lookup successful: {result}")
+        logger.debug("Phone number lookup successful: %s", result)
         return result
     
     except TwilioRestException as e:
         if e.status == 404:
-            print(f"Phone number {phone_number} is not valid.")
+            logger.warning("Phone number %s is not valid.", phone_number)
         else:
-            print(f"Phone Number lookup failed. Twilio Error: {e}")
+            logger.error("Phone Number lookup failed. Twilio Error: %s", e)
         return None
     except Exception as e:
-        print(f"An unexpected error occurred during phone number lookup: {e}")
+        logger.error("An unexpected error occurred during phone number lookup: %s", e)
         return None
\ No newline at end of file
@@ -0,0 +1,294 @@
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+logger = logging.getLogger(__name__)
+
+## Bucket upper bounds (seconds) shared by all latency histograms.
+## They cover fast SQLite queries (sub-millisecond) up to slow LLM / telephony calls.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_lock = threading.Lock()
+_histograms = {}   ## (name, labels) -> [bucket_counts, sum, count]
+_counters = {}     ## (name, labels) -> float
+_gauges = {}       ## (name, labels) -> float
+_gauge_callbacks = {}  ## name -> callable returning a number
+_gauge_aggregate = {}  ## name -> "max" for gauges that already describe every worker (default: summed)
+_help = {}
+
+## With METRICS_DIR set (gunicorn with several workers), every worker writes a snapshot of its
+## registry to METRICS_DIR/metrics-<pid>-<start>.json and /metrics renders the sum of all of
+## them, so whichever worker answers the scrape reports the whole server. Counters and
+## histograms of exited workers stay in the total (clear the directory on deploy); gauges
+## only count workers whose snapshot is fresher than three flush intervals.
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+_flusher_pid = None
+_snapshot_pid = None
+_snapshot_path = None
+_snapshot_lock = threading.Lock()
+
+
+def _label_key(labels: dict | None) -> tuple:
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def observe(name: str, value: float, labels: dict | None = None):
+    """
+    Records a single observation (in seconds) into the latency histogram `name`.
+
+    Args:
+        name (str): Metric name, e.g. "llm_request_seconds".
+        value (float): Observed value in seconds.
+        labels (dict, optional): Extra Prometheus labels, e.g. {"stage": "sentiment"}.
+    """
+    key = (name, _label_key(labels))
+    idx = bisect_left(LATENCY_BUCKETS, value)
+    with _lock:
+        entry = _histograms.get(key)
+        if entry is None:
+            entry = _histograms[key] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0, 0]
+        entry[0][idx] += 1
+        entry[1] += value
+        entry[2] += 1
+
+
+def inc(name: str, amount: float = 1, labels: dict | None = None):
+    """Increments the counter `name` by `amount`."""
+    key = (name, _label_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def set_gauge(name: str, value: float, labels: dict | None = None, aggregate: str = "sum"):
+    """
+    Sets the gauge `name` to `value`.
+
+    Args:
+        aggregate (str): How workers' values combine with METRICS_DIR: "sum", or "max" for
+                         values that are the same for every worker (timings, shared state).
+    """
+    with _lock:
+        _gauges[(name, _label_key(labels))] = value
+    if aggregate != "sum":
+        _gauge_aggregate[name] = aggregate
+
+
+def register_gauge(name: str, callback, help_text: str = "", aggregate: str = "sum"):
+    """
+    Registers a gauge whose value is computed at scrape time (e.g. a queue length).
+    The callback must be cheap and must not raise; errors are reported as NaN.
+    `aggregate` is as for `set_gauge`.
+    """
+    _gauge_callbacks[name] = callback
+    if aggregate != "sum":
+        _gauge_aggregate[name] = aggregate
+    if help_text:
+        _help[name] = help_text
+
+
+def describe(name: str, help_text: str):
+    """Attaches a HELP line to a metric for the Prometheus exposition."""
+    _help[name] = help_text
+
+
+def record_cache(cache: str, hit: bool):
+    """Records a cache lookup so hit rates can be derived from /metrics."""
+    inc("cache_requests_total", labels={"cache": cache, "result": "hit" if hit else "miss"})
+
+
+@contextmanager
+def timer(name: str, **labels):
+    """
+    Context manager that records the wall-clock duration of the wrapped block.
+
+    Example:
+        with timer("db_query_seconds", query="fetch_customer_by_id"):
+            ...
+
+    Failures are counted separately under the label outcome="error" so that slow
+    errors do not hide inside the success distribution.
+    """
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        labels["outcome"] = outcome
+        observe(name, time.perf_counter() - start, labels)
+
+
+def timed(name: str, **labels):
+    """Decorator version of `timer` for functions."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(name, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    items = labels + extra
+    if not items:
+        return ""
+    parts = []
+    for key, value in items:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _collect() -> tuple[dict, dict, dict]:
+    """This process's (histograms, counters, gauges), with the callback gauges evaluated."""
+    with _lock:
+        histograms = {k: (list(v[0]), v[1], v[2]) for k, v in _histograms.items()}
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+
+    for name, callback in list(_gauge_callbacks.items()):
+        try:
+            gauges[(name, ())] = float(callback())
+        except Exception:
+            gauges[(name, ())] = float("nan")
+    return histograms, counters, gauges
+
+
+def write_snapshot():
+    """Writes this process's registry to its file in METRICS_DIR (atomically)."""
+    global _snapshot_pid, _snapshot_path
+    if not METRICS_DIR:
+        return
+    histograms, counters, gauges = _collect()
+    snapshot = {
+        "written_at": time.time(),
+        "histograms": [[name, labels, buckets, total, count] for (name, labels), (buckets, total, count) in histograms.items()],
+        "counters": [[name, labels, value] for (name, labels), value in counters.items()],
+        "gauges": [[name, labels, value] for (name, labels), value in gauges.items()],
+    }
+    with _snapshot_lock:
+        ## A forked worker gets its own file; the start time keeps a reused pid from overwriting a dead worker's totals
+        if _snapshot_pid != os.getpid():
+            os.makedirs(METRICS_DIR, exist_ok = True)
+            _snapshot_pid = os.getpid()
+            _snapshot_path = os.path.join(METRICS_DIR, f"metrics-{_snapshot_pid}-{int(time.time() * 1000)}.json")
+        tmp_path = f"{_snapshot_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, _snapshot_path)
+
+
+def start_flusher():
+    """
+    Starts the background thread that writes this worker's snapshot every FLUSH_SECONDS.
+    Call once per worker process (e.g. from the app's lifespan hook); no-op without METRICS_DIR.
+    """
+    global _flusher_pid
+    if not METRICS_DIR or _flusher_pid == os.getpid():
+        return
+    _flusher_pid = os.getpid()
+
+    def flush_forever():
+        while True:
+            try:
+                write_snapshot()
+            except Exception as e:
+                logger.warning("Could not write the metrics snapshot: %s", e)
+            time.sleep(FLUSH_SECONDS)
+
+    threading.Thread(target = flush_forever, name = "metrics-flusher", daemon = True).start()
+
+
+def _collect_all() -> tuple[dict, dict, dict]:
+    """Sum of every worker's snapshot in METRICS_DIR (this worker's written fresh first)."""
+    write_snapshot()
+    histograms, counters, gauges = {}, {}, {}
+    fresh_after = time.time() - 3 * FLUSH_SECONDS
+    for path in glob.glob(os.path.join(METRICS_DIR, "metrics-*.json")):
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, labels, buckets, total, count in snapshot["histograms"]:
+            key = (name, tuple(map(tuple, labels)))
+            entry = histograms.get(key)
+            if entry is None:
+                histograms[key] = (buckets, total, count)
+            else:
+                histograms[key] = ([a + b for a, b in zip(entry[0], buckets)], entry[1] + total, entry[2] + count)
+        for name, labels, value in snapshot["counters"]:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        if snapshot["written_at"] < fresh_after:
+            continue
+        for name, labels, value in snapshot["gauges"]:
+            key = (name, tuple(map(tuple, labels)))
+            if key not in gauges:
+                gauges[key] = value
+            elif _gauge_aggregate.get(name) == "max":
+                gauges[key] = max(gauges[key], value)
+            else:
+                gauges[key] += value
+    return histograms, counters, gauges
+
+
+def render_prometheus() -> str:
+    """
+    Renders every metric in the Prometheus text exposition format (version 0.0.4),
+    summed over all workers when METRICS_DIR is set.
+
+    Returns:
+        str: The body for the /metrics endpoint.
+    """
+    histograms, counters, gauges = _collect_all() if METRICS_DIR else _collect()
+
+    lines = []
+    seen = set()
+
+    def header(name, kind):
+        if name in seen:
+            return
+        seen.add(name)
+        if name in _help:
+            lines.append(f"# HELP {name} {_help[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), (buckets, total, count) in sorted(histograms.items()):
+        header(name, "histogram")
+        cumulative = 0
+        for bound, bucket_count in zip(LATENCY_BUCKETS, buckets):
+            cumulative += bucket_count
+            lines.append(f"{name}_bucket{_format_labels(labels, (('le', bound),))} {cumulative}")
+        lines.append(f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {count}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+        lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+    for (name, labels), value in sorted(counters.items()):
+        header(name, "counter")
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    for (name, labels), value in sorted(gauges.items()):
+        header(name, "gauge")
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+describe("http_request_seconds", "Total time spent handling an HTTP request.")
+describe("webhook_stage_seconds", "Time spent in each stage of a Vapi webhook turn.")
+describe("llm_request_seconds", "Latency of calls to the Groq API.")
+describe("db_query_seconds", "Latency of SQLite queries issued by Database.")
+describe("external_call_seconds", "Latency of calls to Twilio and Vapi.")
+describe("action_seconds", "Time spent by Action_agent executing an action.")
+describe("cache_requests_total", "Cache lookups, labelled by cache and hit/miss.")
@@ -0,0 +1,179 @@
+import contextvars
+import cProfile
+import hmac
+import io
+import itertools
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+from src.services import metrics_service
+
+logger = logging.getLogger(__name__)
+
+## Requests carrying "X-Profile: <ADMIN_TOKEN>" are profiled; the token also guards /admin/profiles
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+## Fraction of all requests profiled without the header (0 disables sampling)
+SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+## Finished profiles kept in memory; the oldest is dropped when the buffer is full
+BUFFER_SIZE = int(os.getenv("PROFILE_BUFFER_SIZE", "20"))
+PROFILE_HEADER = "x-profile"
+
+ENABLED = bool(ADMIN_TOKEN) or SAMPLE_RATE > 0
+
+_current = contextvars.ContextVar("request_profile", default = None)
+_thread_state = threading.local()   ## .busy: this thread already has a profiler running
+_profiles = deque(maxlen = BUFFER_SIZE)
+_ids = itertools.count(1)
+_lock = threading.Lock()
+
+
+class Request_profile:
+    """Call-stack profile of one request, merged from every thread that worked on it."""
+
+    def __init__(self, method: str, path: str, trigger: str):
+        self.id = next(_ids)
+        self.method = method
+        self.path = path
+        self.trigger = trigger
+        self.started_at = time.time()
+        self.duration = None
+        self.status = None
+        self.sections = 0
+        ## Set when another request held the event-loop profiler, so this one has worker threads only
+        self.loop_skipped = False
+        self._stats = None
+        self._lock = threading.Lock()
+
+    def add(self, profiler: cProfile.Profile):
+        profiler.create_stats()
+        with self._lock:
+            self.sections += 1
+            if self._stats is None:
+                self._stats = pstats.Stats(profiler)
+            else:
+                self._stats.add(profiler)
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "trigger": self.trigger,
+            "started_at": self.started_at,
+            "duration_seconds": self.duration,
+            "status": self.status,
+            "sections": self.sections,
+            "loop_skipped": self.loop_skipped,
+        }
+
+    def render(self, sort: str = "cumulative", limit: int = 40) -> str:
+        """pstats report of the hottest `limit` functions ordered by `sort`."""
+        with self._lock:
+            if self._stats is None:
+                return "No profile data captured.\n"
+            out = io.StringIO()
+            self._stats.stream = out
+            self._stats.sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+
+def should_profile(headers) -> str | None:
+    """
+    Decides whether to profile a request.
+
+    Returns:
+        str | None: "header" or "sample" when the request should be profiled, else None.
+    """
+    token = headers.get(PROFILE_HEADER)
+    if token is not None and is_admin(token):
+        return "header"
+    if SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE:
+        return "sample"
+    return None
+
+
+def is_admin(token: str | None) -> bool:
+    return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(token, ADMIN_TOKEN)
+
+
+@contextmanager
+def profile_section():
+    """
+    Profiles the wrapped block into the current request's profile, if it has one.
+
+    Without an active profile this is a single context-variable lookup. Nested
+    sections on the same thread are covered by the outer one (cProfile can only run
+    one profiler per thread).
+    """
+    profile = _current.get()
+    if profile is None or getattr(_thread_state, "busy", False):
+        yield
+        return
+    profiler = cProfile.Profile()
+    _thread_state.busy = True
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _thread_state.busy = False
+        profile.add(profiler)
+
+
+def profiled(func):
+    """Decorator version of `profile_section`, for functions run in worker threads."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with profile_section():
+            return func(*args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def profile_request(method: str, path: str, trigger: str):
+    """
+    Profiles one request: the event-loop thread while the handler runs, plus any
+    `profiled` work it starts in worker threads (the profile travels in a context
+    variable, which asyncio copies into tasks and `to_thread` calls).
+
+    The event-loop part also sees other requests' coroutines that run in between;
+    if another profiled request already holds the loop profiler it is skipped.
+    """
+    profile = Request_profile(method, path, trigger)
+    token = _current.set(profile)
+    start = time.perf_counter()
+    try:
+        if getattr(_thread_state, "busy", False):
+            profile.loop_skipped = True
+            yield profile
+        else:
+            with profile_section():
+                yield profile
+    finally:
+        profile.duration = time.perf_counter() - start
+        _current.reset(token)
+        with _lock:
+            _profiles.append(profile)
+        metrics_service.inc("request_profiles_total", labels = {"trigger": trigger})
+        logger.info("Captured request profile %d for %s %s (%.3fs)", profile.id, method, path, profile.duration)
+
+
+def list_profiles() -> list[dict]:
+    """Summaries of the buffered profiles, newest first."""
+    with _lock:
+        return [profile.summary() for profile in reversed(_profiles)]
+
+
+def get_profile(profile_id: int) -> Request_profile | None:
+    with _lock:
+        return next((profile for profile in _profiles if profile.id == profile_id), None)
+
+
+metrics_service.describe("request_profiles_total", "Requests profiled, by trigger (header or sample).")
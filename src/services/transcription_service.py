@@ -1,9 +1,13 @@
 # from json import load
 # import speech_recognition as sr
-from groq import Groq, GroqError
 import os 
+import logging
 from dotenv import load_dotenv
 
+from src.services.metrics_service import timer
+
+logger = logging.getLogger(__name__)
+
 load_dotenv()
 
 # recognizer = sr.Recognizer()
@@ -60,7 +64,7 @@ def transcribe_audio_file(file_path: str, api_key = None) -> str:
      """
     
     if not file_path:
-        print("Transcription Service: No file path provided.")
+        logger.error("Transcription Service: No file path provided.")
         return "[ERROR: No file path provided]"
     
     api_key = api_key or os.getenv("GROQ_API_KEY")
@@ -68,29 +72,32 @@ def transcribe_audio_file(file_path: str, api_key = None) -> str:
     if not api_key:
         raise ValueError("Groq API key not provided.")
 
+    ## Imported lazily: the groq SDK is only needed when a recording is uploaded
+    from groq import Groq, GroqError
+
     try:
         client = Groq(api_key=api_key)
-        print("Transcription Service: Initiated Groq Client.")
-        print(f"TranscriptionService: Processing file at {file_path} using Whisper.")
+        logger.debug("TranscriptionService: Processing file at %s using Whisper.", file_path)
 
         with open(file_path, 'rb') as audio_file:
             ## Calling groq model for transcription
 
-            transcription = client.audio.transcriptions.create(
-                model = "whisper-large-v3",
-                file = audio_file,
-                response_format = "text"
-            )
+            with timer("llm_request_seconds", agent = "transcription", model = "whisper-large-v3"):
+                transcription = client.audio.transcriptions.create(
+                    model = "whisper-large-v3",
+                    file = audio_file,
+                    response_format = "text"
+                )
         
         result = str(transcription)
 
-        print(f"Transcription Service: Success -> '{result[:100]}'")
+        logger.debug("Transcription Service: Success -> '%s'", result[:100])
         return result
 
     except GroqError as e:
-        print(f"Transcription Service: Groq API error during transcription: {e}")
+        logger.error("Transcription Service: Groq API error during transcription: %s", e)
         return f"[Groq API error: {e.status_code} - {e.message}]"
     
     except Exception as e:
-        print(f"Transcription Service: An unexpected error occurred: {e}")
+        logger.error("Transcription Service: An unexpected error occurred: %s", e)
         return f"[Transcription failed: {e}]"
\ No newline at end of file
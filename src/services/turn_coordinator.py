@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+
+from src.services import metrics_service
+
+logger = logging.getLogger(__name__)
+
+## How often in-flight work re-checks whether a newer fragment arrived (possibly on another worker)
+POLL_SECONDS = int(os.getenv("TURN_POLL_MS", "100")) / 1000
+## Turn state of calls that never sent call-end is dropped after this long without a fragment
+STALE_SECONDS = 2 * 3600
+PRUNE_EVERY_SECONDS = 600
+
+
+@dataclass(frozen = True)
+class Turn:
+    """A (possibly merged) user utterance that is ready to be answered."""
+    call_id: str
+    generation: int
+    transcript: str
+    fragment_count: int
+
+
+class Turn_coordinator:
+    """
+    Per-call coordination of user transcript events.
+
+    Vapi can send several `transcript` messages in quick succession when a caller pauses
+    mid-sentence. Each fragment opens a short debounce window; if another fragment for
+    the same call arrives inside it, the earlier request steps aside and the latest one
+    answers the merged text. A newer fragment also cancels LLM work still in flight for
+    an older one, so we never pay for (or speak) an answer to a stale utterance.
+
+    Vapi's webhook requests for one call are spread over all gunicorn workers, so the
+    generation counter and the unanswered fragments live in the shared database
+    (`call_turns` / `turn_fragments`). In-flight work polls the generation and stops when
+    a newer fragment shows up on any worker; work in this process is also cancelled
+    directly. Calls are forgotten on `end_call`, or after STALE_SECONDS without a fragment.
+    """
+
+    def __init__(self, get_db, debounce_seconds: float | None = None, poll_seconds: float = POLL_SECONDS):
+        if debounce_seconds is None:
+            debounce_seconds = int(os.getenv("TURN_DEBOUNCE_MS", "300")) / 1000
+        self.get_db = get_db
+        self.debounce_seconds = debounce_seconds
+        self.poll_seconds = poll_seconds
+        self._in_flight = {}    ## call_id -> asyncio.Task doing this process's LLM work for the call
+        self._last_prune = 0.0
+
+        metrics_service.register_gauge("turns_in_flight", self._in_flight_count, "Turns with LLM work currently running.")
+
+    def _in_flight_count(self) -> int:
+        return sum(1 for task in list(self._in_flight.values()) if not task.done())
+
+    async def collect(self, call_id: str, fragment: str) -> Turn | None:
+        """
+        Registers a transcript fragment and waits out the debounce window.
+
+        Returns:
+            Turn | None: The merged turn to answer, or None if a newer fragment for the
+                         same call arrived meanwhile (that request will answer instead).
+        """
+        db = self.get_db()
+        if time.time() - self._last_prune > PRUNE_EVERY_SECONDS:
+            self._last_prune = time.time()
+            await asyncio.to_thread(db.prune_call_turns, time.time() - STALE_SECONDS)
+
+        generation = await asyncio.to_thread(db.add_turn_fragment, call_id, fragment)
+
+        task = self._in_flight.get(call_id)
+        if task and not task.done():
+            task.cancel()
+            metrics_service.inc("turns_cancelled_total")
+            logger.debug("Cancelled in-flight turn for a newer transcript")
+
+        if self.debounce_seconds > 0:
+            await asyncio.sleep(self.debounce_seconds)
+
+        if await asyncio.to_thread(db.turn_generation, call_id) != generation:
+            metrics_service.inc("transcript_fragments_coalesced_total")
+            return None
+
+        fragments = await asyncio.to_thread(db.pending_fragments, call_id, generation)
+        return Turn(call_id, generation, " ".join(fragments), len(fragments))
+
+    def is_current(self, turn: Turn) -> bool:
+        """True while no newer fragment has arrived for the turn's call (blocking; call from a worker thread)."""
+        return self.get_db().turn_generation(turn.call_id) == turn.generation
+
+    async def run(self, turn: Turn, func, *args):
+        """
+        Runs the blocking `func(*args)` in a worker thread as the call's in-flight work.
+
+        Returns:
+            The function's result, or None if the turn was superseded before it finished.
+        """
+        if not await asyncio.to_thread(self.is_current, turn):
+            return None
+
+        task = asyncio.create_task(asyncio.to_thread(func, *args))
+        self._in_flight[turn.call_id] = task
+        try:
+            while not task.done():
+                await asyncio.wait({task}, timeout = self.poll_seconds)
+                if not task.done() and not await asyncio.to_thread(self.is_current, turn):
+                    ## Superseded on another worker
+                    task.cancel()
+                    metrics_service.inc("turns_cancelled_total")
+                    logger.debug("Cancelled in-flight turn for a newer transcript on another worker")
+        finally:
+            if self._in_flight.get(turn.call_id) is task:
+                del self._in_flight[turn.call_id]
+
+        if task.cancelled() or not await asyncio.to_thread(self.is_current, turn):
+            return None
+        return task.result()
+
+    async def complete(self, turn: Turn):
+        """Marks the turn's fragments as answered so they are not merged into the next turn."""
+        await asyncio.to_thread(self.get_db().complete_turn, turn.call_id, turn.generation)
+
+    async def end_call(self, call_id: str):
+        """Forgets a call, cancelling any work still in flight for it in this process."""
+        task = self._in_flight.pop(call_id, None)
+        if task and not task.done():
+            task.cancel()
+        await asyncio.to_thread(self.get_db().end_call_turns, call_id)
@@ -1,5 +1,9 @@
 import os
-import requests
+import logging
+
+from src.services.metrics_service import timer
+
+logger = logging.getLogger(__name__)
 
 # 1. LOAD NEW ENVIRONMENT VARIABLE
 VAPI_API_KEY = os.getenv("VAPI_API_KEY")
@@ -13,15 +17,18 @@ def start_phone_call(customer_phone: str) -> dict:
     """
     
     # 2. ADD DEBUG LOGS TO CHECK IF ENV VARS ARE LOADED
-    # (We only print part of the key for security)
-    print(f"VapiService: Using API Key (last 4 chars): ...{VAPI_API_KEY[-4:] if VAPI_API_KEY else 'NOT_SET'}")
-    print(f"VapiService: Using Assistant ID: {VAPI_ASSISTANT_ID if VAPI_ASSISTANT_ID else 'NOT_SET'}")
-    print(f"VapiService: Using Phone Number ID: {VAPI_PHONE_NUMBER_ID if VAPI_PHONE_NUMBER_ID else 'NOT_SET'}")
+    # (We only log part of the key for security)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("VapiService: Using API Key (last 4 chars): ...%s", VAPI_API_KEY[-4:] if VAPI_API_KEY else 'NOT_SET')
+        logger.debug("VapiService: Using Assistant ID: %s", VAPI_ASSISTANT_ID or 'NOT_SET')
+        logger.debug("VapiService: Using Phone Number ID: %s", VAPI_PHONE_NUMBER_ID or 'NOT_SET')
 
     # 3. UPDATE THE VALIDATION CHECK
     if not all([VAPI_API_KEY, VAPI_ASSISTANT_ID, VAPI_PHONE_NUMBER_ID]):
         raise ValueError("Vapi API Key, Assistant ID, or Phone Number ID is not configured in environment variables.")
 
+    import requests
+
     headers = {"Authorization": f"Bearer {VAPI_API_KEY}"}
     
     # 4. ADD THE MISSING 'phoneNumberId' TO THE PAYLOAD
@@ -31,23 +38,22 @@ def start_phone_call(customer_phone: str) -> dict:
         "customer": {"number": customer_phone}
     }
 
-    print(f"VapiService: Initiating call to {customer_phone} with payload: {payload}")
-    response = requests.post("https://api.vapi.ai/call/phone", headers=headers, json=payload)
+    logger.debug("VapiService: Initiating call to %s with payload: %s", customer_phone, payload)
+    with timer("external_call_seconds", service = "vapi", operation = "start_phone_call"):
+        response = requests.post("https://api.vapi.ai/call/phone", headers=headers, json=payload)
     
     # Check for detailed error messages from Vapi
     if not response.ok:
         try:
             # Try to print the detailed error from Vapi's server
             error_detail = response.json()
-            print(f"!!!!!!!!!!!!!! VAPI API ERROR !!!!!!!!!!!!!!")
-            print(f"Vapi returned status {response.status_code} with detail: {error_detail}")
-            print(f"!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
+            logger.error("VAPI API ERROR: Vapi returned status %s with detail: %s", response.status_code, error_detail)
         except requests.exceptions.JSONDecodeError:
             # If Vapi sends a non-JSON error (like HTML)
-            print(f"Vapi returned non-JSON error: {response.text}")
+            logger.error("Vapi returned non-JSON error: %s", response.text)
     
     # Raise an exception if the call fails (e.g., 400, 500 status codes)
     response.raise_for_status()
     
-    print("VapiService: Call initiated successfully.")
+    logger.info("VapiService: Call initiated successfully.")
     return response.json()
\ No newline at end of file